@@ -18,9 +18,15 @@ from config import Config
 from database.db import (
     get_user, save_file_data, get_post_channel, get_index_db_channel,
     save_post, get_users_with_daily_notify_enabled, get_stats_for_owner,
-    get_monthly_record, update_monthly_record
+    get_monthly_record, update_monthly_record, ensure_indexes, save_batch_episodes
 )
-from utils.helpers import create_post, clean_and_parse_filename, notify_and_remove_invalid_channel
+from utils.helpers import create_post, clean_and_parse_filename, notify_and_remove_invalid_channel, parse_episode_numbers
+from util.chunk_cache import chunk_cache, index_cache
+from util.client_pool import client_pool
+from util.media_session import get_session_manager
+from util.bandwidth import bandwidth
+from util.prewarm import prewarmer
+from util.file_properties import StreamFile
 from thefuzz import fuzz
 from collections import defaultdict
 
@@ -39,6 +45,7 @@ class Bot(Client):
         self.me = None
         self.web_app = None
         self.web_runner = None
+        self.web_workers = None
 
         self.owner_db_channel = Config.OWNER_DB_CHANNEL
         self.stream_channel_id = None
@@ -207,10 +214,12 @@ class Bot(Client):
             file_infos = await asyncio.gather(*tasks)
 
             logical_batches = {}
+            info_by_id = {}
             SIMILARITY_THRESHOLD = 85
             for i, info in enumerate(file_infos):
                 if not info or not info.get("batch_title"): continue
                 current_msg = messages[i]
+                info_by_id[current_msg.id] = info
                 current_title = info["batch_title"]
                 best_match_key = max(logical_batches.keys(), key=lambda k: fuzz.token_set_ratio(current_title, k), default=None)
                 if best_match_key and fuzz.token_set_ratio(current_title, best_match_key) > SIMILARITY_THRESHOLD:
@@ -218,6 +227,7 @@ class Bot(Client):
                 else: logical_batches[current_title] = [current_msg]
 
             total_batches = len(logical_batches)
+            batch_ids = await self._save_batches(user_id, logical_batches, info_by_id)
             if dashboard_msg:
                 status = f"✅ **Status:** Found `{total_batches}` logical series/batches. Processing..."
                 await self.execute_with_retry(dashboard_msg.edit_text, await self._generate_dashboard_text(collection_data, status))
@@ -233,7 +243,7 @@ class Bot(Client):
                     status = f"🚀 **Status:** Posting batch {i + 1}/{total_batches} ('{batch_title}')..."
                     await self.execute_with_retry(dashboard_msg.edit_text, await self._generate_dashboard_text(collection_data, status))
 
-                posts_to_send = await create_post(self, user_id, batch_messages, self.imdb_cache)
+                posts_to_send = await create_post(self, user_id, batch_messages, self.imdb_cache, batch_id=batch_ids.get(batch_title))
                 if not posts_to_send:
                     logger.warning(f"No posts generated for batch '{batch_title}' for user {user_id}.")
                     await self.send_message(user_id, f"⚠️ **Skipped Batch:** No valid posts could be generated for '{batch_title}'.")
@@ -272,6 +282,28 @@ class Bot(Client):
             if user_id in self.waiting_files and self.waiting_files[user_id]:
                 await self._start_new_collection(user_id, self.waiting_files.pop(user_id))
     
+    async def _save_batches(self, user_id, logical_batches, info_by_id):
+        """
+        Tags the files of every multi-file batch with a batch id (for /zip) and their
+        season/episode (for next-episode prefetch). Returns {batch_title: batch_id}.
+        """
+        batch_ids = {}
+        for batch_title, batch_messages in logical_batches.items():
+            if len(batch_messages) < 2:
+                continue
+            episodes = [
+                (msg.id, *parse_episode_numbers(info_by_id.get(msg.id)))
+                for msg in batch_messages
+            ]
+            # Telegram start payloads allow only [A-Za-z0-9_-]
+            batch_id = f"{user_id}-{min(msg.id for msg in batch_messages)}"
+            try:
+                await save_batch_episodes(batch_id, episodes)
+                batch_ids[batch_title] = batch_id
+            except Exception as e:
+                logger.warning(f"Could not save batch '{batch_title}' of user {user_id}: {e}")
+        return batch_ids
+
     async def process_new_file(self, message, user_id):
         async with self.user_batch_locks[user_id]:
             try:
@@ -299,6 +331,12 @@ class Bot(Client):
 
                 logger.info(f"File '{media.file_name}' copied to Owner DB. New message ID: {copied_message.id}")
                 await save_file_data(user_id, message, copied_message, copied_message)
+                stream_file = StreamFile.from_message(copied_message, owner_id=user_id)
+                if Config.PREWARM_ENABLED and stream_file and (stream_file.mime_type or "").startswith("video/"):
+                    if self.web_workers:
+                        self.web_workers.prewarm(stream_file.message_id)
+                    else:
+                        prewarmer.schedule(stream_file)
 
                 if user_id in self.processing_users:
                     self.waiting_files.setdefault(user_id, []).append(copied_message)
@@ -338,10 +376,14 @@ class Bot(Client):
 
     async def start_web_server(self):
         from server.stream_routes import routes as stream_routes
-        self.web_app = web.Application()
+        from util.admission import admission_middleware
+        from util.signing import signed_link_middleware
+        self.web_app = web.Application(middlewares=[signed_link_middleware, admission_middleware])
         self.web_app['bot'] = self
         self.web_app.add_routes(stream_routes)
-        self.web_runner = web.AppRunner(self.web_app)
+        # Cancel the handler when the client disconnects, so an abandoned
+        # stream stops its upstream GetFile calls immediately.
+        self.web_runner = web.AppRunner(self.web_app, handler_cancellation=True)
         await self.web_runner.setup()
         
         # --- DECREED MODIFICATION: Bind to 0.0.0.0 and use PORT from env ---
@@ -354,6 +396,14 @@ class Bot(Client):
         await site.start()
         logger.info(f"Web server started successfully. Public URL: {self.app_url} (Bound to 0.0.0.0:{port})")
 
+    async def start_web_workers(self):
+        """Hands the web tier to WEB_WORKERS processes; this one keeps updates and ingest."""
+        from server.workers import WorkerSupervisor
+        sessions = [await member.client.export_session_string() for member in client_pool.members]
+        self.web_workers = WorkerSupervisor(Config.WEB_WORKERS)
+        self.web_workers.start(sessions)
+        logger.info(f"Web tier running in {Config.WEB_WORKERS} worker processes. Public URL: {self.app_url}")
+
 
     async def daily_restart_handler(self):
         while True:
@@ -519,12 +569,43 @@ class Bot(Client):
         else:
             logger.warning("⚠️ Owner DB Channel ID not set.")
 
-        # --- Web server ---
-        await self.start_web_server()
+        try:
+            await ensure_indexes()
+        except Exception as e:
+            logger.error(f"Could not ensure DB indexes (non-fatal): {e}")
+
+        # --- Stream chunk cache (index survives restarts; web workers keep their own) ---
+        if not Config.WEB_WORKERS:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, chunk_cache.load)
+                await asyncio.get_running_loop().run_in_executor(None, index_cache.load)
+            except Exception as e:
+                logger.error(f"Chunk cache load failed (non-fatal): {e}")
+
+        # --- Stream client pool (main bot + optional helper bots) ---
+        client_pool.add(f"@{self.me.username}", self, primary=True)
+        if Config.MULTI_TOKENS:
+            await client_pool.start_helpers(Config.MULTI_TOKENS)
+
+        # --- Web server (in this process, or WEB_WORKERS separate ones) ---
+        if Config.WEB_WORKERS:
+            await self.start_web_workers()
+        else:
+            await self.start_web_server()
 
         # --- Background tasks ---
         asyncio.create_task(self.connection_health_check())
         asyncio.create_task(self.daily_stats_notifier())
+        if not Config.WEB_WORKERS:
+            if chunk_cache.enabled:
+                asyncio.create_task(chunk_cache.run_index_flusher())
+            if index_cache.enabled:
+                asyncio.create_task(index_cache.run_index_flusher())
+            asyncio.create_task(bandwidth.run_usage_flusher())
+            for member in client_pool.members:
+                sessions = get_session_manager(member.client)
+                asyncio.create_task(sessions.warm_up())
+                asyncio.create_task(sessions.reap_idle())
 
         # ❌ Daily restart disabled (Koyeb handles restarts)
         # asyncio.create_task(self.daily_restart_handler())
@@ -534,7 +615,14 @@ class Bot(Client):
     async def stop(self, *args):
         logger.info("Stopping bot...")
         if self.web_runner: await self.web_runner.cleanup()
-        await super.stop()
+        if self.web_workers: await self.web_workers.stop()
+        await chunk_cache.flush_index()
+        await index_cache.flush_index()
+        await bandwidth.flush_usage()
+        for member in client_pool.members:
+            await get_session_manager(member.client).close_all()
+        await client_pool.stop_helpers()
+        await super().stop()
         logger.info("Bot stopped.")
 
 if __name__ == "__main__":
@@ -34,3 +34,129 @@ class Config:
     # ================================================================= #
     # Yahan apna tutorial video ya channel ka link daalein
     TUTORIAL_URL = os.environ.get("TUTORIAL_URL", "https://t.me/howtoopennlinks/19")
+
+    # ================= STREAMING ENGINE =================
+    # How many 1 MB GetFile parts each /stream or /download keeps in flight.
+    STREAM_PREFETCH_PARTS = int(os.environ.get("STREAM_PREFETCH_PARTS", "4"))
+    # Upper bound on bytes buffered ahead of a single client (default 8 MB).
+    STREAM_MAX_BUFFER = int(os.environ.get("STREAM_MAX_BUFFER", str(8 * 1024 * 1024)))
+    # In-process cache of stream message metadata (entries / seconds).
+    META_CACHE_SIZE = int(os.environ.get("META_CACHE_SIZE", "4096"))
+    META_CACHE_TTL = int(os.environ.get("META_CACHE_TTL", "900"))
+    # Deleted/empty messages are remembered for a shorter time.
+    META_CACHE_NEGATIVE_TTL = int(os.environ.get("META_CACHE_NEGATIVE_TTL", "60"))
+    # Local disk cache of stream parts for hot files (0 disables it).
+    CHUNK_CACHE_DIR = os.environ.get("CHUNK_CACHE_DIR", "stream_cache")
+    CHUNK_CACHE_BYTES = int(os.environ.get("CHUNK_CACHE_BYTES", str(1024 * 1024 * 1024)))
+    # Extra bot tokens used only to download media for the web tier (space or comma separated).
+    # Each helper bot must be an admin of the Owner DB channel.
+    MULTI_TOKENS = [t for t in os.environ.get("MULTI_TOKENS", "").replace(",", " ").split() if t]
+    # How many active streams one recent FloodWait counts as when picking a client.
+    FLOOD_WAIT_PENALTY = float(os.environ.get("FLOOD_WAIT_PENALTY", "4"))
+    # Media sessions kept per DC (per client) and how long an idle extra one lives.
+    MEDIA_SESSIONS_PER_DC = int(os.environ.get("MEDIA_SESSIONS_PER_DC", "2"))
+    MEDIA_SESSION_IDLE_TIMEOUT = int(os.environ.get("MEDIA_SESSION_IDLE_TIMEOUT", "600"))
+    # Identical part fetches are shared between viewers; finished parts are kept
+    # in memory this many seconds (bounded by PART_SHARE_MAX_BYTES).
+    PART_SHARE_RETENTION = float(os.environ.get("PART_SHARE_RETENTION", "15"))
+    PART_SHARE_MAX_BYTES = int(os.environ.get("PART_SHARE_MAX_BYTES", str(64 * 1024 * 1024)))
+    # Cache-Control for media bytes (immutable per file) and for the /watch page.
+    MEDIA_CACHE_CONTROL = os.environ.get("MEDIA_CACHE_CONTROL", "public, max-age=31536000, immutable")
+    WATCH_CACHE_CONTROL = os.environ.get("WATCH_CACHE_CONTROL", "public, max-age=300")
+    # Mid-stream recovery: retries per part, first backoff (seconds, doubles each
+    # time) and the longest FloodWait a running stream will sit through.
+    STREAM_RETRY_ATTEMPTS = int(os.environ.get("STREAM_RETRY_ATTEMPTS", "5"))
+    STREAM_RETRY_BACKOFF = float(os.environ.get("STREAM_RETRY_BACKOFF", "0.5"))
+    STREAM_MAX_FLOOD_SLEEP = int(os.environ.get("STREAM_MAX_FLOOD_SLEEP", "60"))
+    # Follow upload.FileCdnRedirect to Telegram's CDN DCs for popular files
+    # (falls back to the main DC if the CDN misbehaves). Off by default: pyrogram
+    # ships neither the CDN DC addresses nor their RSA keys (help.getCdnConfig), so
+    # every redirect currently ends in a fallback after an extra round trip.
+    STREAM_CDN_ENABLED = os.environ.get("STREAM_CDN_ENABLED", "False").lower() in ("true", "1", "yes")
+    # Slow-client eviction: a connection whose writes stay blocked for
+    # STREAM_WRITE_TIMEOUT seconds, or that drains slower than STREAM_MIN_CLIENT_RATE
+    # bytes/s over a STREAM_SLOW_CLIENT_GRACE window while we wait on it, is closed
+    # (0 disables the respective check).
+    STREAM_MIN_CLIENT_RATE = int(os.environ.get("STREAM_MIN_CLIENT_RATE", str(32 * 1024)))
+    STREAM_SLOW_CLIENT_GRACE = int(os.environ.get("STREAM_SLOW_CLIENT_GRACE", "60"))
+    STREAM_WRITE_TIMEOUT = int(os.environ.get("STREAM_WRITE_TIMEOUT", "120"))
+    # Admission control: concurrent /stream + /download responses allowed in
+    # total and per client IP, and concurrent /watch pages (0 = unlimited).
+    # Requests over a cap get 503 with Retry-After (seconds).
+    ADMISSION_MAX_STREAMS = int(os.environ.get("ADMISSION_MAX_STREAMS", "200"))
+    ADMISSION_MAX_STREAMS_PER_IP = int(os.environ.get("ADMISSION_MAX_STREAMS_PER_IP", "8"))
+    ADMISSION_MAX_PAGES = int(os.environ.get("ADMISSION_MAX_PAGES", "100"))
+    ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "5"))
+    # Take the client IP from X-Forwarded-For, as behind the Koyeb/Heroku router this
+    # app is deployed on. TRUSTED_PROXY_HOPS is how many proxies append an entry
+    # (1 for a single PaaS router); the client is that many entries from the right.
+    # Requests without the header get no per-IP cap or client bucket, since their
+    # socket address is the proxy's. Set False only when clients connect directly.
+    TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "True").lower() in ("true", "1", "yes")
+    TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+    # Fair-share egress (bytes/s, 0 = unlimited): the total split between active
+    # owners by weight, the default cap per owner, and the cap per client IP.
+    # Owners can get their own `stream_weight` / `stream_rate_limit` via /bandwidth.
+    STREAM_EGRESS_LIMIT = int(os.environ.get("STREAM_EGRESS_LIMIT", "0"))
+    STREAM_OWNER_RATE_LIMIT = int(os.environ.get("STREAM_OWNER_RATE_LIMIT", "0"))
+    STREAM_CLIENT_RATE_LIMIT = int(os.environ.get("STREAM_CLIENT_RATE_LIMIT", "0"))
+    # Seconds between batched writes of per-owner byte counts to Mongo.
+    STREAM_USAGE_FLUSH_INTERVAL = int(os.environ.get("STREAM_USAGE_FLUSH_INTERVAL", "60"))
+    # Signed media links: HMAC secrets (space/comma separated, the first signs new
+    # links, the rest still verify during a rotation; empty = derived from BOT_TOKEN),
+    # link lifetime and the bucket expiries are rounded up to (seconds).
+    LINK_SECRETS = [s for s in os.environ.get("LINK_SECRETS", "").replace(",", " ").split() if s]
+    LINK_TTL = int(os.environ.get("LINK_TTL", str(24 * 3600)))
+    LINK_EXPIRY_BUCKET = int(os.environ.get("LINK_EXPIRY_BUCKET", "3600"))
+    # Migration window for old unsigned /watch, /stream and /download links: off by
+    # default. Set LINK_ALLOW_LEGACY=True with LINK_LEGACY_UNTIL (ISO date, e.g. two weeks
+    # out) while old links are still being replaced; no end date is logged as an error.
+    LINK_ALLOW_LEGACY = os.environ.get("LINK_ALLOW_LEGACY", "False").lower() in ("true", "1", "yes")
+    LINK_LEGACY_UNTIL = os.environ.get("LINK_LEGACY_UNTIL", "")
+    # Pre-warm new uploads at ingest: the first/last bytes of each video are
+    # pinned in the chunk cache, in a tier with its own budget (CHUNK_CACHE_PIN_BYTES).
+    PREWARM_ENABLED = os.environ.get("PREWARM_ENABLED", "True").lower() in ("true", "1", "yes")
+    PREWARM_HEAD_BYTES = int(os.environ.get("PREWARM_HEAD_BYTES", str(4 * 1024 * 1024)))
+    PREWARM_TAIL_BYTES = int(os.environ.get("PREWARM_TAIL_BYTES", str(2 * 1024 * 1024)))
+    CHUNK_CACHE_PIN_BYTES = int(os.environ.get("CHUNK_CACHE_PIN_BYTES", str(256 * 1024 * 1024)))
+    # Next-episode prefetch: once a stream passes PREFETCH_PROGRESS (0-1) of an
+    # episode, the first PREFETCH_HEAD_BYTES of the next one in its batch are cached,
+    # using at most PREFETCH_RATE_LIMIT bytes/s of upstream bandwidth overall.
+    PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "True").lower() in ("true", "1", "yes")
+    PREFETCH_PROGRESS = float(os.environ.get("PREFETCH_PROGRESS", "0.7"))
+    PREFETCH_HEAD_BYTES = int(os.environ.get("PREFETCH_HEAD_BYTES", str(8 * 1024 * 1024)))
+    PREFETCH_RATE_LIMIT = int(os.environ.get("PREFETCH_RATE_LIMIT", str(2 * 1024 * 1024)))
+    # Player probes (HEAD, bytes=0-1, the last few KB): ranges up to PROBE_MAX_BYTES
+    # inside the first/last PROBE_WINDOW bytes are answered from memory, for up to
+    # PROBE_CACHE_FILES files for PROBE_CACHE_TTL seconds.
+    PROBE_WINDOW = int(os.environ.get("PROBE_WINDOW", str(64 * 1024)))
+    PROBE_MAX_BYTES = int(os.environ.get("PROBE_MAX_BYTES", str(64 * 1024)))
+    PROBE_CACHE_FILES = int(os.environ.get("PROBE_CACHE_FILES", "512"))
+    PROBE_CACHE_TTL = int(os.environ.get("PROBE_CACHE_TTL", "3600"))
+    # Container index cache: MP4 moov / MKV Cues located on first access, their
+    # byte ranges saved on the file record and kept on disk here (0 disables it).
+    # Indexes larger than INDEX_MAX_BYTES per file are not pinned.
+    INDEX_CACHE_DIR = os.environ.get("INDEX_CACHE_DIR", "stream_index_cache")
+    INDEX_CACHE_BYTES = int(os.environ.get("INDEX_CACHE_BYTES", str(256 * 1024 * 1024)))
+    INDEX_MAX_BYTES = int(os.environ.get("INDEX_MAX_BYTES", str(32 * 1024 * 1024)))
+    # Rendered /watch pages (pre-compressed gzip/brotli) kept in memory per
+    # message id and signed query.
+    WATCH_PAGE_CACHE_SIZE = int(os.environ.get("WATCH_PAGE_CACHE_SIZE", "2048"))
+    WATCH_PAGE_CACHE_TTL = int(os.environ.get("WATCH_PAGE_CACHE_TTL", "3600"))
+    # Run the web tier as this many separate processes sharing PORT via SO_REUSEPORT
+    # (0 = serve from the bot process). Workers reuse the bot's sessions, get their
+    # own cache subdirectory and a 1/N share of every cache, admission (global and
+    # per-IP) and bandwidth (egress, per-owner incl. /bandwidth, per-client) budget.
+    # Per-IP, per-owner and per-client caps are enforced per worker, so one client's
+    # effective cap ranges from ceil(cap/N) to about the configured value depending
+    # on how its connections spread. New uploads are pre-warmed in every worker.
+    WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "0"))
+    # Set by the supervisor inside each worker: how many processes share the budgets.
+    WEB_WORKER_COUNT = int(os.environ.get("WEB_WORKER_COUNT", "1"))
+    # Adaptive GetFile tuning per DC: parts in flight sized to sustain
+    # STREAM_TUNER_TARGET_RATE bytes/s per stream, and each 1 MB part split into
+    # up to STREAM_TUNER_MAX_SPLIT parallel requests (1, 2 or 4). When disabled,
+    # STREAM_PREFETCH_PARTS whole parts are used.
+    STREAM_TUNER_ENABLED = os.environ.get("STREAM_TUNER_ENABLED", "True").lower() in ("true", "1", "yes")
+    STREAM_TUNER_TARGET_RATE = int(os.environ.get("STREAM_TUNER_TARGET_RATE", str(8 * 1024 * 1024)))
+    STREAM_TUNER_MAX_SPLIT = int(os.environ.get("STREAM_TUNER_MAX_SPLIT", "4"))
@@ -3,6 +3,7 @@
 import datetime
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 from config import Config
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
@@ -18,6 +19,8 @@ verified_users = db['verified_users']
 # --- NEW: Collections for Daily Stats ---
 daily_stats = db['daily_stats']
 monthly_records = db['monthly_records']
+# Bytes streamed per owner per day
+stream_usage = db['stream_usage']
 
 
 async def add_user(user_id):
@@ -187,9 +190,11 @@ async def get_backup_channels(user_id: int):
 async def save_file_data(owner_id, original_message, copied_message, stream_message):
     """Saves file metadata, including the new stream_id."""
     from utils.helpers import get_file_raw_link
+    from util.file_properties import StreamFile
 
     original_media = getattr(original_message, original_message.media.value)
     raw_link = await get_file_raw_link(copied_message)
+    stream_file = StreamFile.from_message(stream_message)
 
     file_data = {
         'owner_id': owner_id,
@@ -206,6 +211,10 @@ async def save_file_data(owner_id, original_message, copied_message, stream_mess
         'raw_link': raw_link
     }
 
+    # GetFile location of the channel copy, so /stream never has to fetch the message
+    if stream_file:
+        file_data['stream_location'] = stream_file.location_record()
+
     await files.update_one(
         {
             'owner_id': owner_id,
@@ -215,6 +224,56 @@ async def save_file_data(owner_id, original_message, copied_message, stream_mess
         upsert=True
     )
 
+async def get_file_by_stream_id(stream_id: int):
+    """Fetches a file record by the message id of its copy in the stream channel."""
+    return await files.find_one({'stream_id': stream_id})
+
+async def update_stream_location(stream_id: int, location: dict):
+    """Stores a (re)resolved GetFile location, e.g. after a file_reference refresh."""
+    await files.update_many({'stream_id': stream_id}, {'$set': {'stream_location': location}})
+
+async def set_media_index(stream_id: int, media_index: dict):
+    """Saves where the container index (moov / Cues) of a stream file lives."""
+    await files.update_many({'stream_id': stream_id}, {'$set': {'media_index': media_index}})
+
+async def ensure_indexes():
+    """Creates the indexes the web tier relies on. Safe to call on every start."""
+    await files.create_index('stream_id')
+    await files.create_index([('batch_id', 1), ('season', 1), ('episode', 1)], sparse=True)
+    await stream_usage.create_index([('owner_id', 1), ('date', 1)], unique=True)
+
+async def save_batch_episodes(batch_id: str, episodes: list):
+    """Tags stream files with their batch and (stream_id, season, episode, episode_end) placement; episode may be None."""
+    if not episodes:
+        return
+    await files.bulk_write([
+        UpdateOne({'stream_id': stream_id}, {'$set': {
+            'batch_id': batch_id, 'season': season, 'episode': episode, 'episode_end': episode_end
+        }})
+        for stream_id, season, episode, episode_end in episodes
+    ], ordered=False)
+
+async def get_batch_files(batch_id: str):
+    """Every file of a batch, in season/episode order."""
+    cursor = files.find({'batch_id': batch_id}).sort([('season', 1), ('episode', 1), ('stream_id', 1)])
+    return await cursor.to_list(length=None)
+
+async def get_next_episode(batch_id: str, season: int | None, episode_end: int):
+    """The first file of the batch after `episode_end` in the same season."""
+    return await files.find_one(
+        {'batch_id': batch_id, 'season': season, 'episode': {'$gt': episode_end}},
+        sort=[('episode', 1)]
+    )
+
+async def add_stream_usage(usage: dict):
+    """Adds {owner_id: bytes} to today's stream_usage documents in one bulk write."""
+    today_utc = datetime.datetime.utcnow().date()
+    today_start = datetime.datetime(today_utc.year, today_utc.month, today_utc.day)
+    await stream_usage.bulk_write([
+        UpdateOne({'owner_id': owner_id, 'date': today_start}, {'$inc': {'bytes': size}}, upsert=True)
+        for owner_id, size in usage.items()
+    ], ordered=False)
+
 async def get_user(user_id):
     return await users.find_one({'user_id': user_id})
 
@@ -1,15 +1,18 @@
 # widhvans/store/widhvans-store-9eccd1e4991c3966a09275ea218d1ea1248ed0fe/handlers/admin.py
 import logging
 import asyncio
+from collections import Counter
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import Config
 from database.db import (
     total_users_count, get_all_user_ids, get_storage_owners_count,
-    get_storage_owner_ids, get_normal_user_ids, delete_all_files
+    get_storage_owner_ids, get_normal_user_ids, delete_all_files, update_user
 )
 from features.broadcaster import broadcast_message
-from utils.helpers import go_back_button
+from utils.helpers import go_back_button, format_bytes, split_message
+from util.bandwidth import owner_settings
+from util.stream_health import collect_stream_stats, merge_stream_stats
 
 logger = logging.getLogger(__name__)
 
@@ -37,8 +40,179 @@ async def health_check_handler(client, message):
         text += f"\n**Last Known Error:**\n`{client.last_health_check_error or 'No specific error logged, check console.'}`"
     else:
         text += "\nAll systems are operational. File processing is immediate."
-        
-    await message.reply_text(text)
+
+    if client.web_workers:
+        workers = client.web_workers.stats()
+        snapshots = await client.web_workers.collect_stats()
+        text += (
+            f"\n\n**Web Workers:** `{workers['running']}`/`{workers['workers']}` running, "
+            f"`{workers['restarts']}` restarts (stream stats below summed over `{len(snapshots)}` that replied)"
+        )
+        stats = merge_stream_stats(snapshots)
+    else:
+        stats = collect_stream_stats()
+    if stats:
+        text += _stream_health_text(stats)
+
+    # Busy servers (many workers, clients and DCs) outgrow one Telegram message.
+    for part in split_message(text):
+        await message.reply_text(part)
+
+
+def _stream_health_text(stats: dict):
+    snapshot = stats['monitor']
+    totals = snapshot['totals']
+    text = (
+        f"\n\n**📡 Streaming**\n"
+        f"**Active Streams:** `{snapshot['active']}` (`{format_bytes(snapshot['egress_rate']) or '0 B'}/s`)\n"
+        f"**Served Since Start:** `{totals['streams']}` streams, `{format_bytes(totals['bytes_sent']) or '0 B'}`\n"
+    )
+    gate = stats['admission']
+    text += (
+        f"**Admission:** `{gate['streams']}`/`{gate['max_streams'] or '∞'}` stream slots from `{gate['clients']}` IPs "
+        f"(peak `{gate['peak']}`), `{gate['pages']}` pages rendering\n"
+        f"**Admitted:** " + (", ".join(f"{k} `{v}`" for k, v in gate['admitted'].items()) or "`0`") +
+        " · **Shed (503):** " + (", ".join(f"{k} `{v}`" for k, v in gate['shed'].items()) or "`0`") + "\n"
+    )
+    links = stats['links']
+    if links['accepted'] or links['rejected']:
+        text += (
+            "**Links:** " + (", ".join(f"{k} `{v}`" for k, v in links['accepted'].items()) or "`0`") +
+            " · **Rejected:** " + (", ".join(f"{k} `{v}`" for k, v in links['rejected'].items()) or "`0`") + "\n"
+        )
+    if snapshot['recoveries']:
+        text += "**Upstream Recoveries:** " + ", ".join(
+            f"{reason} `{count}`" for reason, count in snapshot['recoveries'].items()
+        ) + "\n"
+    if snapshot['evictions']:
+        text += "**Evicted Slow Clients:** " + ", ".join(
+            f"{reason} `{count}`" for reason, count in snapshot['evictions'].items()
+        ) + "\n"
+    meta = stats['meta_cache']
+    msgs = stats['message_cache']
+    text += (
+        f"**Metadata Cache:** `{meta['size']}` entries, hit ratio `{meta['hit_ratio']:.0%}` "
+        f"(`{meta['hits']}` hits, `{meta['negative_hits']}` negative, `{meta['misses']}` misses, `{meta['coalesced']}` coalesced)\n"
+        f"**get_messages Cache:** `{msgs['misses']}` RPCs, `{msgs['hits'] + msgs['negative_hits'] + msgs['coalesced']}` avoided\n"
+    )
+    pages = stats['page_cache']
+    if pages['hits'] or pages['misses']:
+        text += (
+            f"**Watch Page Cache:** `{pages['size']}` pages, hit ratio `{pages['hit_ratio']:.0%}` "
+            f"(`{pages['misses']}` renders)\n"
+        )
+    probes = stats['probe_cache']
+    if probes['hits'] or probes['misses']:
+        text += (
+            f"**Probe Cache:** `{probes['size']}` windows, `{probes['hits'] + probes['coalesced']}` probes from memory, "
+            f"`{probes['misses']}` upstream reads\n"
+        )
+    disk = stats['chunk_cache']
+    if disk['enabled']:
+        text += (
+            f"**Disk Chunk Cache:** `{format_bytes(disk['size']) or '0 B'}` / `{format_bytes(disk['max_bytes'])}` "
+            f"in `{disk['parts']}` parts, hit ratio `{disk['hit_ratio']:.0%}`\n"
+            f"**Bytes Saved:** `{format_bytes(disk['bytes_saved']) or '0 B'}` (`{disk['evictions']}` evictions)\n"
+            f"**Pinned:** `{disk['pinned_parts']}` parts, `{format_bytes(disk['pinned_size']) or '0 B'}` / "
+            f"`{format_bytes(disk['pin_max_bytes']) or '0 B'}`\n"
+        )
+        warm = stats['prewarm']
+        if warm['scheduled']:
+            text += (
+                f"**Pre-warm:** `{warm['files']}` files, `{warm['parts']}` parts (`{format_bytes(warm['bytes']) or '0 B'}`), "
+                f"`{warm['queued']}` queued, `{warm['failures']}` failed, `{warm['dropped']}` dropped\n"
+            )
+    idx = stats['indexes']
+    if idx['cache_enabled'] and (idx['located'] or idx['cache_parts']):
+        text += (
+            f"**Container Indexes:** `{idx['located']}` located, `{idx['not_found']}` without one, "
+            f"`{idx['cache_parts']}` parts (`{format_bytes(idx['cache_size']) or '0 B'}`) pinned, "
+            f"`{idx['cache_hits']}` served from cache\n"
+        )
+    nxt = stats['prefetch']
+    if nxt['triggers']:
+        text += (
+            f"**Next-Episode Prefetch:** `{nxt['files']}` prefetched (`{format_bytes(nxt['bytes']) or '0 B'}`), "
+            f"hit ratio `{nxt['hit_ratio']:.0%}` (`{nxt['hits']}` hits, `{nxt['misses']}` misses, `{nxt['pending']}` pending), "
+            f"`{nxt['no_next']}` without a next episode\n"
+        )
+    shared = stats['parts']
+    text += (
+        f"**Upstream Parts:** `{shared['fetched']}` fetched, `{shared['shared'] + shared['reused']}` shared "
+        f"(`{format_bytes(shared['bytes_deduplicated']) or '0 B'}` deduplicated)\n"
+    )
+    if totals['cancelled_parts']:
+        text += (
+            f"**Cancelled Read-Ahead:** `{totals['cancelled_parts']}` parts "
+            f"(`{format_bytes(totals['cancelled_bytes']) or '0 B'}`), `{shared['cancelled']}` upstream fetches stopped\n"
+        )
+    cdn = stats['cdn']
+    if cdn['redirects']:
+        text += (
+            f"**CDN:** `{cdn['files']}` files, `{cdn['parts']}` parts (`{format_bytes(cdn['bytes']) or '0 B'}`), "
+            f"`{cdn['reuploads']}` reuploads, `{cdn['fallbacks']}` fallbacks to main DC\n"
+        )
+    tuned = stats['tuning']
+    if tuned:
+        text += "**GetFile Tuning:** " + ", ".join(
+            f"DC{dc} `{t['limit'] // 1024} KB` x `{t['window']}` in flight"
+            + (f" (RTT `{t['rtt_ms']}ms`, `{format_bytes(t['rate'])}/s` per request)" if t['fitted'] else " (learning)")
+            for dc, t in tuned.items()
+        ) + "\n"
+    pool = stats['clients']
+    if len(pool) > 1:
+        text += "**Stream Clients:**\n"
+        for c in pool:
+            state = f"paused `{c['paused_for']}s`" if c['paused_for'] else "in rotation"
+            text += f"  - {c['name']}: `{c['active']}` active, `{c['served']}` served, `{c['flood_waits']}` FloodWaits, {state}\n"
+    bw = stats['bandwidth']
+    if bw['egress_limit'] or bw['throttled_seconds'] or bw['top_owners']:
+        text += (
+            f"**Fair Share:** limit `{format_bytes(bw['egress_limit']) + '/s' if bw['egress_limit'] else 'none'}`, "
+            f"`{bw['active_owners']}` owners / `{bw['active_clients']}` clients active, "
+            f"throttled `{bw['throttled_seconds']}s`\n"
+        )
+        top_owners = Counter()
+        for owner, size in bw['top_owners']:
+            top_owners[owner] += size
+        if top_owners:
+            text += "**Top Owners:** " + ", ".join(
+                f"`{owner}` {format_bytes(size)}" for owner, size in top_owners.most_common(3)
+            ) + "\n"
+    for name, dcs in stats['sessions'].items():
+        if dcs:
+            text += f"**Media Sessions ({name}):** " + ", ".join(
+                f"{dc} `{h['sessions']}`×(`{h['in_flight']}` busy, `{h['failures']}` err, idle `{h['idle']}s`)"
+                for dc, h in dcs.items()
+            ) + "\n"
+    for s in sorted(snapshot['streams'], key=lambda s: s['throughput'], reverse=True)[:5]:
+        text += (
+            f"  - `#{s['message_id']}` DC{s['dc_id']}: `{format_bytes(s['throughput']) or '0 B'}/s`, "
+            f"waited `{s['upstream_wait']}s` on `{s['parts']}` parts\n"
+        )
+    return text
+
+
+@Client.on_message(filters.command("bandwidth") & filters.user(Config.ADMIN_ID))
+async def bandwidth_handler(_, message):
+    """/bandwidth <owner_id> <weight> [limit_kb_per_s] — per-owner fair-share settings."""
+    try:
+        owner_id = int(message.command[1])
+        weight = float(message.command[2])
+        limit = int(float(message.command[3]) * 1024) if len(message.command) > 3 else 0
+        if weight <= 0 or limit < 0:
+            raise ValueError
+    except (IndexError, ValueError):
+        return await message.reply_text(
+            "Usage: `/bandwidth <owner_id> <weight> [limit_kb_per_s]`\n"
+            "Weight is relative to other owners (default 1); a limit of 0 uses the global default."
+        )
+    await update_user(owner_id, 'stream_weight', weight)
+    await update_user(owner_id, 'stream_rate_limit', limit)
+    owner_settings.invalidate(owner_id)
+    await message.reply_text(
+        f"Owner `{owner_id}`: weight `{weight}`, limit `{format_bytes(limit) + '/s' if limit else 'default'}`."
+    )
 
 
 @Client.on_message(filters.command("stats") & filters.user(Config.ADMIN_ID))
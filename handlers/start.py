@@ -16,12 +16,14 @@ from config import Config
 from database.db import (
     add_user,
     get_file_by_unique_id,
+    get_batch_files,
     get_user,
     update_user,
     record_daily_view,
     save_file_data
 )
-from utils.helpers import get_main_menu
+from utils.helpers import get_main_menu, format_bytes
+from util.signing import link_signer
 from features.shortener import get_shortlink
 
 logger = logging.getLogger(__name__)
@@ -71,6 +73,32 @@ async def set_verified_24h(user_id):
     await update_user(user_id, "verified_until", expires)
 
 
+async def require_verification(client, message, requester_id, owner_id):
+    """True when the requester may proceed; otherwise sends the verify prompt."""
+    if requester_id == owner_id:
+        return True
+    if await is_verified_24h(await get_user(requester_id)):
+        return True
+
+    deep = f"https://t.me/{client.me.username}?start=verify"
+    verify_link = await get_shortlink(deep, owner_id)
+
+    await safe_reply(
+        message,
+        "🔐 **Verification Required**\n\n"
+        "Verify once to unlock files for **24 hours**.",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Verify Now", url=verify_link)],
+            [InlineKeyboardButton(
+                "🎬 How To Download",
+                url=Config.TUTORIAL_URL
+            )]
+        ]),
+        parse_mode=enums.ParseMode.MARKDOWN
+    )
+    return False
+
+
 # =================================================
 #               PRIVATE UPLOAD
 # =================================================
@@ -106,7 +134,7 @@ async def handle_private_file(client, message):
         buttons = [[
             InlineKeyboardButton(
                 "📺 Stream / Download",
-                url=f"{Config.APP_URL.rstrip('/')}/watch/{copied.id}"
+                url=link_signer.url(Config.APP_URL, "watch", copied.id)
             )
         ]]
 
@@ -163,6 +191,11 @@ async def start_command(client, message):
                     client, message, requester_id, payload
                 )
 
+            elif payload.startswith("zip_"):
+                await handle_zip_request(
+                    client, message, requester_id, payload[len("zip_"):]
+                )
+
             elif payload.startswith("ownerget_"):
                 parts = payload.split("_")
                 owner_id = int(parts[1])
@@ -224,26 +257,9 @@ async def handle_public_file_request(client, message, requester_id, payload):
         return await safe_reply(message, "❌ Invalid or expired link.")
 
     owner_settings = await get_user(owner_id)
-    requester = await get_user(requester_id)
 
-    if requester_id != owner_id:
-        if not await is_verified_24h(requester):
-            deep = f"https://t.me/{client.me.username}?start=verify"
-            verify_link = await get_shortlink(deep, owner_id)
-
-            return await safe_reply(
-                message,
-                "🔐 **Verification Required**\n\n"
-                "Verify once to unlock files for **24 hours**.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✅ Verify Now", url=verify_link)],
-                    [InlineKeyboardButton(
-                        "🎬 How To Download",
-                        url=Config.TUTORIAL_URL
-                    )]
-                ]),
-                parse_mode=enums.ParseMode.MARKDOWN
-            )
+    if not await require_verification(client, message, requester_id, owner_id):
+        return
 
     file_data = await get_file_by_unique_id(owner_id, file_unique_id)
     if not file_data:
@@ -274,6 +290,42 @@ async def handle_public_file_request(client, message, requester_id, payload):
     await send_file(client, requester_id, owner_id, file_unique_id)
 
 
+# =================================================
+#           BATCH ZIP HANDLER
+# =================================================
+
+async def handle_zip_request(client, message, requester_id, batch_id):
+    try:
+        owner_id = int(batch_id.split("-")[0])
+    except ValueError:
+        return await safe_reply(message, "❌ Invalid or expired link.")
+
+    if not await require_verification(client, message, requester_id, owner_id):
+        return
+
+    records = await get_batch_files(batch_id)
+    if not records:
+        return await safe_reply(message, "❌ Invalid or expired link.")
+
+    await record_daily_view(owner_id, requester_id)
+    total_size = sum(r.get('file_size') or 0 for r in records)
+
+    await safe_reply(
+        message,
+        "📦 **Your Batch Is Ready!**\n\n"
+        f"🗂 **Files:** {len(records)}\n"
+        f"💾 **Size:** {format_bytes(total_size)}\n\n"
+        "Downloads as one ZIP archive.",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton(
+                "📥 Download ZIP",
+                url=link_signer.url(Config.APP_URL, "zip", batch_id)
+            )]
+        ]),
+        parse_mode=enums.ParseMode.MARKDOWN
+    )
+
+
 # =================================================
 #                   SEND FILE
 # =================================================
@@ -288,7 +340,7 @@ async def send_file(client, requester_id, owner_id, file_unique_id):
     buttons = [[
         InlineKeyboardButton(
             "📺 Stream / Download",
-            url=f"{Config.APP_URL.rstrip('/')}/watch/{file_data['stream_id']}"
+            url=link_signer.url(Config.APP_URL, "watch", file_data['stream_id'])
         )
     ]]
 
@@ -1,12 +1,31 @@
 # server/stream_routes.py
 
+import time
+import asyncio
 import logging
+from contextlib import aclosing
 from aiohttp import web
 from aiohttp.client_exceptions import ClientConnectionResetError
-from util.render_template import render_player_page
-from util.custom_dl import ByteStreamer
-from util.file_properties import get_media_from_message
-from pyrogram.errors import RPCError
+from util.render_template import player_page
+from util.custom_dl import ByteStreamer, stored_stream_file
+from util.stream_stats import stream_monitor, SlowClientGuard
+from util.chunk_cache import CachedPart
+from util.client_pool import client_pool
+from util.admission import client_ip
+from util.signing import signed_query
+from util.bandwidth import bandwidth
+from util.prewarm import episode_prefetcher
+from util.probe_cache import read_probe, cached_probe
+from util.media_index import media_indexer
+from util.zipstream import ZipEntry, ZipStream, unique_names
+from database.db import get_batch_files
+from util.http_range import (
+    RangeNotSatisfiable, MultipartRanges, make_etag, parse_range_header, if_range_matches,
+    is_not_modified, http_date, pick_encoding
+)
+from util.render_template import player_page_etag
+from config import Config
+from pyrogram.errors import RPCError, FloodWait, InternalServerError
 
 logger = logging.getLogger(__name__)
 routes = web.RouteTableDef()
@@ -30,11 +49,34 @@ async def watch_handler(request):
     try:
         message_id = int(request.match_info["message_id"])
         bot = request.app["bot"]
-
-        content = await render_player_page(bot, message_id)
+        # Only the verified exp/sig are carried over; never reflect the raw query.
+        query = signed_query(request.query)
+
+        # The page depends only on the message id, its signed query and the template,
+        # so it can be revalidated without rendering.
+        validators = {
+            "ETag": player_page_etag(bot, message_id, query),
+            "Cache-Control": Config.WATCH_CACHE_CONTROL,
+            "Vary": "Accept-Encoding"
+        }
+        if is_not_modified(request.headers, validators["ETag"]):
+            return web.Response(status=304, headers=validators)
+
+        page = await player_page(bot, message_id, query)
+        if page is None:
+            return web.Response(
+                text="<h1>500 - Internal Server Error</h1><p>Could not render the page.</p>",
+                content_type="text/html",
+                status=500
+            )
+        encoding = pick_encoding(request.headers.get("Accept-Encoding"), page)
+        if encoding != "identity":
+            validators["Content-Encoding"] = encoding
         return web.Response(
-            text=content,
-            content_type="text/html"
+            body=page[encoding],
+            content_type="text/html",
+            charset="utf-8",
+            headers=validators
         )
 
     except Exception as e:
@@ -46,108 +88,256 @@ async def watch_handler(request):
         )
 
 
-# ================= STREAM =================
-
-@routes.get(r"/stream/{message_id:\d+}")
-async def stream_handler(request):
-    bot = request.app["bot"]
+# ================= PIPE =================
+
+async def send_cached_part(request, resp, part: CachedPart):
+    """Zero-copy write of a disk-cached slice straight to the client socket."""
+    transport = request.transport
+    if transport is None or transport.is_closing():
+        raise ConnectionResetError("Client transport closed")
+    # loop.sendfile waits for earlier buffered writes to flush before sending.
+    await asyncio.get_running_loop().sendfile(transport, part.file, part.offset, part.length)
+    part.served()
+
+
+async def pipe_file(request, resp, streamer, stream_file, start, end, on_chunk=None):
+    """
+    Writes bytes start..end (inclusive) of the file to a prepared response
+    through the read-ahead engine. Disk-cached parts go out via sendfile,
+    the rest is written from Telegram buffers. Returns the bytes written.
+
+    Clients that stop draining (a write blocked past STREAM_WRITE_TIMEOUT)
+    or drain below STREAM_MIN_CLIENT_RATE are evicted so they don't pin
+    upstream capacity. Writes are paced by the owner's and client's
+    fair-share buckets.
+
+    `on_chunk` sees every chunk before it is written (the ZIP route uses it
+    for CRCs); it needs the bytes in memory, so sendfile is skipped.
+    """
+    offset, first_part_cut, last_part_cut, part_count = streamer.plan_range(start, end)
+    message_id = stream_file.message_id
+    stats = stream_monitor.open(message_id, stream_file.dc_id, start, end)
+    guard = SlowClientGuard(Config.STREAM_MIN_CLIENT_RATE, Config.STREAM_SLOW_CLIENT_GRACE)
+    write_timeout = Config.STREAM_WRITE_TIMEOUT or None
+    lease = await bandwidth.open(stream_file.owner_id, client_ip(request))
+    episode_prefetcher.on_stream_start(stream_file)
+    media_indexer.on_stream_start(stream_file)
 
     try:
-        message_id = int(request.match_info["message_id"])
-        streamer = ByteStreamer(bot)
+        async with aclosing(streamer.yield_file(
+            stream_file, offset, first_part_cut, last_part_cut, part_count, stats=stats, allow_file=on_chunk is None
+        )) as body:
+            async for chunk in body:
+                # A cached part holds an open fd until closed, even if the
+                # response is cancelled while it waits on its bandwidth lease.
+                try:
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+                    await lease.consume(len(chunk))
+                    write_started = time.monotonic()
+                    if isinstance(chunk, CachedPart):
+                        await asyncio.wait_for(send_cached_part(request, resp, chunk), write_timeout)
+                    else:
+                        await asyncio.wait_for(resp.write(chunk), write_timeout)
+                except asyncio.TimeoutError:
+                    evict_client(request, stats, "stalled")
+                    break
+                except (
+                    ClientConnectionResetError,
+                    ConnectionResetError,
+                    BrokenPipeError,
+                    ConnectionError
+                ):
+                    logger.info(f"Client disconnected for message_id {message_id}")
+                    break
+                finally:
+                    if isinstance(chunk, CachedPart):
+                        chunk.close()
+                stats.record_sent(len(chunk))
+                episode_prefetcher.on_progress(stream_file, start, start + stats.bytes_sent)
+                if guard.record_write(len(chunk), time.monotonic() - write_started):
+                    evict_client(request, stats, "slow")
+                    break
+    finally:
+        bandwidth.close(lease)
+        stream_monitor.close(stats)
+
+    return stats.bytes_sent
+
+
+def evict_client(request, stats, reason: str):
+    """Drops a connection that isn't keeping up; buffered bytes are discarded."""
+    stream_monitor.record_eviction(reason)
+    logger.warning(
+        f"Evicting {reason} client {request.remote} on message_id {stats.message_id} "
+        f"after {stats.bytes_sent} bytes in {stats.elapsed:.0f}s"
+    )
+    if request.transport is not None:
+        request.transport.abort()
+
+
+# ================= VALIDATORS =================
+
+def media_validators(stream_file):
+    """ETag / Last-Modified / Cache-Control shared by every media response."""
+    headers = {
+        "ETag": make_etag(stream_file),
+        "Cache-Control": Config.MEDIA_CACHE_CONTROL
+    }
+    if stream_file.date:
+        headers["Last-Modified"] = http_date(stream_file.date)
+    return headers
+
+
+def not_modified_response(request, stream_file, validators):
+    """A 304 if the client's copy is current; needs only cached metadata."""
+    if is_not_modified(request.headers, validators["ETag"], stream_file.date):
+        return web.Response(status=304, headers=validators)
+    return None
+
+
+# ================= RANGES =================
+
+async def head_response(request, status: int, headers: dict):
+    """Headers only, with the Content-Length the matching GET would send."""
+    resp = web.StreamResponse(status=status, headers=headers)
+    await resp.prepare(request)
+    await resp.write_eof()
+    return resp
+
+
+async def serve_ranges(request, streamer, stream_file, headers):
+    """
+    Answers a GET for the whole file with RFC 7233 range semantics:
+    200 for no/ignored Range, 206 for one range, 206 multipart/byteranges for
+    several, and 416 when nothing overlaps. `headers` carries the per-route
+    Content-Type and Content-Disposition.
+
+    HEAD is answered from the stored metadata alone, and small probes at the
+    start or end of the file come from the in-memory probe cache.
+
+    Without a `streamer` only responses that need no Telegram read are
+    sent (HEAD, 304, 416, already-cached probes); None means "needs a client".
+    """
+    file_size = stream_file.file_size
+    validators = media_validators(stream_file)
+    not_modified = not_modified_response(request, stream_file, validators)
+    if not_modified:
+        return not_modified
+    headers = {**headers, "Accept-Ranges": "bytes", **validators}
+
+    ranges = None
+    range_header = request.headers.get("Range")
+    if range_header and if_range_matches(request.headers.get("If-Range"), validators["ETag"], stream_file.date):
+        try:
+            ranges = parse_range_header(range_header, file_size)
+        except RangeNotSatisfiable:
+            return web.Response(status=416, headers={
+                "Content-Range": f"bytes */{file_size}",
+                "Accept-Ranges": "bytes",
+                **validators
+            })
+
+    if not ranges:
+        headers["Content-Length"] = str(file_size)
+        if request.method == "HEAD":
+            return await head_response(request, 200, headers)
+        if streamer is None:
+            return None
+        resp = web.StreamResponse(status=200, headers=headers)
+        await resp.prepare(request)
+        if file_size:
+            await pipe_file(request, resp, streamer, stream_file, 0, file_size - 1)
+        return resp
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Length"] = str(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        if request.method == "HEAD":
+            return await head_response(request, 206, headers)
+        if streamer is None:
+            probe = cached_probe(stream_file, start, end)
+            return web.Response(status=206, body=probe, headers=headers) if probe is not None else None
+        try:
+            probe = await read_probe(streamer, stream_file, start, end)
+        except OSError as e:
+            logger.warning(f"Probe window read failed, streaming instead: {e}")
+            probe = None
+        if probe is not None:
+            return web.Response(status=206, body=probe, headers=headers)
+        resp = web.StreamResponse(status=206, headers=headers)
+        await resp.prepare(request)
+        await pipe_file(request, resp, streamer, stream_file, start, end)
+        return resp
 
-        message = await streamer.get_file_properties(message_id)
-        if not message:
-            return web.Response(status=404, text="File not found.")
+    multipart = MultipartRanges(ranges, file_size, headers.pop("Content-Type"))
+    headers["Content-Type"] = multipart.content_type
+    headers["Content-Length"] = str(multipart.content_length)
+    if request.method == "HEAD":
+        return await head_response(request, 206, headers)
+    if streamer is None:
+        return None
+    resp = web.StreamResponse(status=206, headers=headers)
+    await resp.prepare(request)
+    try:
+        for start, end in ranges:
+            await resp.write(multipart.part_header(start, end))
+            sent = await pipe_file(request, resp, streamer, stream_file, start, end)
+            if sent < end - start + 1:
+                return resp
+            await resp.write(multipart.part_footer())
+        await resp.write(multipart.closing())
+    except (ClientConnectionResetError, ConnectionResetError, BrokenPipeError, ConnectionError):
+        logger.info(f"Client disconnected during multipart response for message_id {stream_file.message_id}")
+    return resp
 
-        media = get_media_from_message(message)
-        if not media:
-            return web.Response(status=404, text="Media not available.")
 
-        file_size = media.file_size
-        file_name = media.file_name or "video.mp4"
-        mime_type = media.mime_type or "video/mp4"
+def unavailable_response(error):
+    """503 for a transient Telegram failure while resolving a file; nothing is cached."""
+    retry_after = error.value if isinstance(error, FloodWait) else Config.ADMISSION_RETRY_AFTER
+    logger.warning(f"File lookup failed transiently ({error!r}); asking the client to retry in {retry_after}s")
+    return web.Response(status=503, text="Temporarily unavailable, please retry.", headers={"Retry-After": str(retry_after)})
 
-        range_header = request.headers.get("Range")
 
-        start = 0
-        end = file_size - 1
-        status = 200
+# ================= STREAM =================
 
-        # ================= RANGE PARSE =================
-        if range_header:
-            status = 206
-            bytes_range = range_header.replace("bytes=", "").split("-")
+async def resolve_stream_file(message_id: int, client):
+    """(streamer, stream_file) for `client`; with no client, the stored file and no streamer."""
+    if client is None:
+        return None, await stored_stream_file(message_id)
+    streamer = ByteStreamer(client)
+    return streamer, await streamer.get_stream_file(message_id)
 
-            if bytes_range[0]:
-                start = int(bytes_range[0])
 
-            if len(bytes_range) > 1 and bytes_range[1]:
-                end = int(bytes_range[1])
+@routes.get(r"/stream/{message_id:\d+}")
+async def stream_handler(request):
+    # HEAD, revalidations and cached probes are answered before a client is picked.
+    response = await _stream_response(request, None)
+    if response is None:
+        async with client_pool.acquire() as client:
+            response = await _stream_response(request, client)
+    return response
 
-        # ================= RANGE VALIDATION =================
-        if start >= file_size:
-            return web.Response(status=416)
 
-        if end >= file_size:
-            end = file_size - 1
+async def _stream_response(request, client):
+    try:
+        message_id = int(request.match_info["message_id"])
+        streamer, stream_file = await resolve_stream_file(message_id, client)
+        if not stream_file:
+            return web.Response(status=404, text="File not found.") if client else None
 
-        content_length = end - start + 1
+        file_name = stream_file.file_name or "video.mp4"
+        mime_type = stream_file.mime_type or "video/mp4"
 
         headers = {
             "Content-Type": mime_type,
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(content_length),
             "Content-Disposition": f'inline; filename="{file_name}"'
         }
+        return await serve_ranges(request, streamer, stream_file, headers)
 
-        if status == 206:
-            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
-
-        resp = web.StreamResponse(status=status, headers=headers)
-        await resp.prepare(request)
-
-        # ================= TELEGRAM SAFE STREAM =================
-
-        chunk_size = 512 * 1024  # 512KB (Telegram safe)
-
-        # Align offset to Telegram chunk boundary
-        aligned_offset = start - (start % chunk_size)
-
-        bytes_sent = 0
-        skip_bytes = start - aligned_offset
-        remaining = content_length
-
-        async for chunk in bot.stream_media(
-            message,
-            offset=aligned_offset,
-            limit=chunk_size
-        ):
-
-            if skip_bytes:
-                chunk = chunk[skip_bytes:]
-                skip_bytes = 0
-
-            if len(chunk) > remaining:
-                chunk = chunk[:remaining]
-
-            try:
-                await resp.write(chunk)
-            except (
-                ClientConnectionResetError,
-                ConnectionResetError,
-                BrokenPipeError,
-                ConnectionError
-            ):
-                break
-
-            bytes_sent += len(chunk)
-            remaining -= len(chunk)
-
-            if remaining <= 0:
-                break
-
-        return resp
+    except (FloodWait, InternalServerError, asyncio.TimeoutError, OSError) as e:
+        return unavailable_response(e)
 
     except RPCError:
         return web.Response(status=404, text="Telegram file inaccessible.")
@@ -161,43 +351,31 @@ async def stream_handler(request):
 
 @routes.get(r"/download/{message_id:\d+}")
 async def download_handler(request):
-    bot = request.app["bot"]
+    response = await _download_response(request, None)
+    if response is None:
+        async with client_pool.acquire() as client:
+            response = await _download_response(request, client)
+    return response
 
+
+async def _download_response(request, client):
     try:
         message_id = int(request.match_info["message_id"])
-        streamer = ByteStreamer(bot)
-
-        # 1️⃣ Fetch message safely
-        message = await streamer.get_file_properties(message_id)
-        if not message:
-            return web.Response(status=404, text="File not found or expired.")
-
-        media = get_media_from_message(message)
-        if not media:
-            return web.Response(status=404, text="Media not available.")
-
-        res = web.StreamResponse(
-            headers={
-                "Content-Type": "application/octet-stream",
-                "Content-Length": str(media.file_size),
-                "Content-Disposition": f'attachment; filename="{media.file_name or "file"}"'
-            }
-        )
-        await res.prepare(request)
-
-        async for chunk in bot.stream_media(message, limit=1024 * 1024):
-            try:
-                await res.write(chunk)
-            except (
-                ClientConnectionResetError,
-                ConnectionResetError,
-                BrokenPipeError,
-                ConnectionError
-            ):
-                logger.info(f"Client disconnected (download) for message_id {message_id}")
-                break
-
-        return res
+
+        # 1️⃣ Resolve the stored location (no Telegram call when persisted)
+        streamer, stream_file = await resolve_stream_file(message_id, client)
+        if not stream_file:
+            return web.Response(status=404, text="File not found or expired.") if client else None
+
+        # 2️⃣ Same range handling as /stream, so download managers can resume and split
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Disposition": f'attachment; filename="{stream_file.file_name or "file"}"'
+        }
+        return await serve_ranges(request, streamer, stream_file, headers)
+
+    except (FloodWait, InternalServerError, asyncio.TimeoutError, OSError) as e:
+        return unavailable_response(e)
 
     except RPCError as e:
         logger.error(f"Telegram RPCError in download_handler: {e}", exc_info=True)
@@ -206,3 +384,61 @@ async def download_handler(request):
     except Exception as e:
         logger.error(f"Error in download_handler: {e}", exc_info=True)
         return web.Response(status=500, text="Internal server error.")
+
+
+# ================= ZIP =================
+
+@routes.get(r"/zip/{batch_id:\d+-\d+}")
+async def zip_handler(request):
+    async with client_pool.acquire() as client:
+        return await _zip_response(request, client)
+
+
+async def _zip_response(request, client):
+    """
+    A whole batch as one store-mode ZIP64 archive, piped file by file from
+    the stream engine. The exact Content-Length comes from the stored sizes;
+    there is no Range support since CRCs are only known while streaming.
+    """
+    batch_id = request.match_info["batch_id"]
+    try:
+        streamer = ByteStreamer(client)
+        stream_files = []
+        for record in await get_batch_files(batch_id):
+            stream_file = await streamer.get_stream_file(record["stream_id"])
+            if stream_file:
+                stream_files.append(stream_file)
+        if not stream_files:
+            return web.Response(status=404, text="Batch not found.")
+    except Exception:
+        logger.exception(f"Could not resolve zip batch {batch_id}")
+        return web.Response(status=500, text="Archive failed.")
+
+    names = unique_names([f.file_name for f in stream_files])
+    archive = ZipStream([ZipEntry(n, f.file_size, f.date) for n, f in zip(names, stream_files)])
+    headers = {
+        "Content-Type": "application/zip",
+        "Content-Disposition": f'attachment; filename="{batch_id}.zip"',
+        "Content-Length": str(archive.content_length),
+        "Cache-Control": "no-store"
+    }
+    if request.method == "HEAD":
+        return await head_response(request, 200, headers)
+
+    resp = web.StreamResponse(status=200, headers=headers)
+    await resp.prepare(request)
+    try:
+        for entry, stream_file in zip(archive.entries, stream_files):
+            await resp.write(entry.local_header())
+            if stream_file.file_size:
+                sent = await pipe_file(
+                    request, resp, streamer, stream_file, 0, stream_file.file_size - 1, on_chunk=entry.update
+                )
+                if sent < stream_file.file_size:
+                    logger.info(f"Zip {batch_id} stopped in message_id {stream_file.message_id} after {sent} bytes")
+                    return resp
+            await resp.write(entry.data_descriptor())
+        await resp.write(archive.trailer())
+    except (ClientConnectionResetError, ConnectionResetError, BrokenPipeError, ConnectionError):
+        logger.info(f"Client disconnected during zip {batch_id}")
+    return resp
@@ -0,0 +1,261 @@
+# server/workers.py
+
+import os
+import sys
+import json
+import signal
+import asyncio
+import logging
+from aiohttp import web
+from config import Config
+from server import web_server
+from util.bandwidth import bandwidth
+from util.chunk_cache import chunk_cache, index_cache
+from util.client_pool import client_pool
+from util.media_session import get_session_manager
+from util.custom_dl import stored_stream_file
+from util.prewarm import prewarmer
+from util.stream_health import collect_stream_stats
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY = 5
+STOP_TIMEOUT = 20
+# Seconds a worker gets to answer a command, and the longest reply line read back.
+REPLY_TIMEOUT = 5
+REPLY_LIMIT = 4 * 1024 * 1024
+
+
+def _share(value: int, workers: int) -> str:
+    return str(-(-value // workers))
+
+
+def worker_env(index: int, workers: int) -> dict:
+    """
+    Worker `index`'s environment: its own cache directories and a 1/N share of
+    the global budgets. The kernel spreads even one client's connections over
+    the workers, so per-IP, per-owner and per-client caps are split too. Those
+    caps are enforced per worker, not shared: a client gets at least
+    ceil(cap / N) and, with its connections spread evenly, up to about the
+    configured cap (N * ceil(cap / N) at most).
+    """
+    env = dict(os.environ)
+    env.update({
+        "WEB_WORKER_INDEX": str(index),
+        "WEB_WORKER_COUNT": str(workers),
+        "CHUNK_CACHE_DIR": os.path.join(Config.CHUNK_CACHE_DIR, f"worker{index}"),
+        "CHUNK_CACHE_BYTES": _share(Config.CHUNK_CACHE_BYTES, workers),
+        "CHUNK_CACHE_PIN_BYTES": _share(Config.CHUNK_CACHE_PIN_BYTES, workers),
+        "INDEX_CACHE_DIR": os.path.join(Config.INDEX_CACHE_DIR, f"worker{index}"),
+        "INDEX_CACHE_BYTES": _share(Config.INDEX_CACHE_BYTES, workers),
+        "ADMISSION_MAX_STREAMS": _share(Config.ADMISSION_MAX_STREAMS, workers),
+        "ADMISSION_MAX_STREAMS_PER_IP": _share(Config.ADMISSION_MAX_STREAMS_PER_IP, workers),
+        "ADMISSION_MAX_PAGES": _share(Config.ADMISSION_MAX_PAGES, workers),
+        "STREAM_EGRESS_LIMIT": _share(Config.STREAM_EGRESS_LIMIT, workers),
+        "STREAM_OWNER_RATE_LIMIT": _share(Config.STREAM_OWNER_RATE_LIMIT, workers),
+        "STREAM_CLIENT_RATE_LIMIT": _share(Config.STREAM_CLIENT_RATE_LIMIT, workers),
+    })
+    return env
+
+
+class WorkerSupervisor:
+    """
+    Runs the web tier as WEB_WORKERS child processes (`python -m server.workers`)
+    that share PORT through SO_REUSEPORT, so the kernel spreads connections
+    across them. The bot's exported session strings go to each child over
+    stdin, never through argv or the environment. Crashed workers are restarted.
+
+    stdin then stays open as a command channel: one JSON object per line
+    ({"id", "op", ...}), answered by one {"id", "result"} line on the child's
+    stdout. The bot uses it for /health stats and to pre-warm new uploads.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._procs = {}
+        self._tasks = []
+        self._sessions = []
+        self._stopping = False
+        self._pending = {}
+        self._next_id = 0
+        self.restarts = 0
+
+    def start(self, sessions: list):
+        self._sessions = sessions
+        self._tasks = [asyncio.create_task(self._supervise(index)) for index in range(self.workers)]
+
+    async def _spawn(self, index: int):
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "server.workers",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=REPLY_LIMIT,
+            env=worker_env(index, self.workers)
+        )
+        proc.stdin.write(json.dumps(self._sessions).encode() + b"\n")
+        await proc.stdin.drain()
+        asyncio.create_task(self._read_replies(proc))
+        logger.info(f"Web worker {index} started (pid {proc.pid}).")
+        return proc
+
+    async def _read_replies(self, proc):
+        while line := await proc.stdout.readline():
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                continue
+            future = self._pending.get(reply.get('id'))
+            if future and not future.done():
+                future.set_result(reply.get('result'))
+
+    async def _ask(self, proc, op: str, **args):
+        self._next_id += 1
+        request_id = self._next_id
+        future = self._pending[request_id] = asyncio.get_running_loop().create_future()
+        try:
+            proc.stdin.write(json.dumps({'id': request_id, 'op': op, **args}).encode() + b"\n")
+            await proc.stdin.drain()
+            return await asyncio.wait_for(future, REPLY_TIMEOUT)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def broadcast(self, op: str, **args) -> list:
+        """Sends one command to every running worker; the replies of those that answered in time."""
+        procs = [p for p in self._procs.values() if p.returncode is None]
+        results = await asyncio.gather(*(self._ask(p, op, **args) for p in procs), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Web worker did not answer '{op}': {result!r}")
+        return [r for r in results if not isinstance(r, BaseException)]
+
+    async def collect_stats(self) -> list:
+        """Each worker's collect_stream_stats(), for /health."""
+        return await self.broadcast('stats')
+
+    def prewarm(self, stream_id: int):
+        """Warms a new upload in every worker: each one serves from its own chunk cache."""
+        asyncio.create_task(self.broadcast('prewarm', stream_id=stream_id))
+
+    async def _supervise(self, index: int):
+        while not self._stopping:
+            try:
+                proc = self._procs[index] = await self._spawn(index)
+                code = await proc.wait()
+            except Exception as e:
+                code = e
+            if self._stopping:
+                break
+            self.restarts += 1
+            logger.error(f"Web worker {index} exited ({code}); restarting in {RESTART_DELAY}s.")
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        procs = [p for p in self._procs.values() if p.returncode is None]
+        for proc in procs:
+            proc.stdin.close()
+            proc.terminate()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(p.wait() for p in procs)), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            for proc in procs:
+                if proc.returncode is None:
+                    proc.kill()
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'running': sum(1 for p in self._procs.values() if p.returncode is None),
+            'restarts': self.restarts,
+        }
+
+
+async def run_command(command: dict):
+    """One supervisor command inside a worker; the result is sent back as JSON."""
+    op = command.get('op')
+    if op == 'stats':
+        return collect_stream_stats()
+    if op == 'prewarm':
+        return prewarmer.schedule(await stored_stream_file(command['stream_id']))
+    raise ValueError(f"unknown command {op!r}")
+
+
+async def answer(line: bytes, replies):
+    request_id = None
+    try:
+        command = json.loads(line)
+        request_id = command.get('id')
+        result = await run_command(command)
+    except Exception as e:
+        logger.error(f"Command {line[:80]!r} failed: {e!r}")
+        result = None
+    replies.write(json.dumps({'id': request_id, 'result': result}, default=str) + "\n")
+    replies.flush()
+
+
+async def handle_commands(commands: asyncio.StreamReader, replies, stop: asyncio.Event):
+    """Answers the supervisor's commands until it closes stdin, which also stops the worker."""
+    while line := await commands.readline():
+        asyncio.create_task(answer(line, replies))
+    stop.set()
+
+
+async def serve(index: int, replies):
+    """One web worker: download-only session copies plus the stream server, until SIGTERM."""
+    loop = asyncio.get_running_loop()
+    commands = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(commands), sys.stdin)
+    sessions = json.loads(await commands.readline() or "[]")
+
+    await client_pool.start_sessions(sessions, f"StreamWorker{index}-")
+    if not client_pool.members:
+        raise SystemExit(f"Web worker {index}: no session could start.")
+    bot = client_pool.members[0].client
+    bot.app_url = Config.APP_URL.rstrip('/')
+
+    try:
+        await loop.run_in_executor(None, chunk_cache.load)
+        await loop.run_in_executor(None, index_cache.load)
+    except Exception as e:
+        logger.error(f"Chunk cache load failed (non-fatal): {e}")
+    if chunk_cache.enabled:
+        asyncio.create_task(chunk_cache.run_index_flusher())
+    if index_cache.enabled:
+        asyncio.create_task(index_cache.run_index_flusher())
+    asyncio.create_task(bandwidth.run_usage_flusher())
+    for member in client_pool.members:
+        sessions = get_session_manager(member.client)
+        asyncio.create_task(sessions.warm_up())
+        asyncio.create_task(sessions.reap_idle())
+
+    runner = web.AppRunner(await web_server(bot), handler_cancellation=True)
+    await runner.setup()
+    port = int(os.environ.get("PORT", 8080))
+    await web.TCPSite(runner, "0.0.0.0", port, reuse_port=True).start()
+    logger.info(f"Web worker {index} serving on 0.0.0.0:{port} with {len(client_pool.members)} client(s).")
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    asyncio.create_task(handle_commands(commands, replies, stop))
+    await stop.wait()
+
+    await runner.cleanup()
+    await chunk_cache.flush_index()
+    await index_cache.flush_index()
+    await bandwidth.flush_usage()
+    for member in client_pool.members:
+        await get_session_manager(member.client).close_all()
+    await client_pool.stop_helpers()
+
+
+if __name__ == "__main__":
+    worker_index = int(os.environ.get("WEB_WORKER_INDEX", "0"))
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - worker{worker_index} - %(name)s - %(levelname)s - %(message)s")
+    logging.getLogger("pyrogram").setLevel(logging.WARNING)
+    # Replies use the real stdout; anything else printed there goes to the log.
+    reply_stream = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    asyncio.run(serve(worker_index, reply_stream))
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# config.py requires these; the tests never talk to Telegram or Mongo.
+for name in ("API_ID", "ADMIN_ID", "OWNER_ID", "LOG_CHANNEL"):
+    os.environ.setdefault(name, "1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+
+pytest.importorskip("aiohttp")
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from config import Config
+from util import admission as admission_module
+from util.admission import AdmissionController, admission_middleware, client_ip
+
+PROXY = "10.0.0.1"
+
+
+def _request(path: str, forwarded: str | None = None):
+    headers = {"X-Forwarded-For": forwarded} if forwarded else {}
+    transport = type("Transport", (), {"get_extra_info": lambda self, name, default=None: (PROXY, 443)})()
+    return make_mocked_request("GET", path, headers=headers, transport=transport)
+
+
+def _hold_streams(monkeypatch, requests):
+    """Runs `requests` through the middleware with all handlers open at once."""
+    controller = AdmissionController(max_streams=1000, max_per_ip=2, max_pages=0)
+    monkeypatch.setattr(admission_module, "admission", controller)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return web.Response(text="ok")
+
+        tasks = [asyncio.create_task(admission_middleware(r, handler)) for r in requests]
+        await asyncio.sleep(0)
+        release.set()
+        return [(await t).status for t in tasks]
+
+    return controller, asyncio.run(run())
+
+
+def test_viewers_behind_one_proxy_are_told_apart(monkeypatch):
+    monkeypatch.setattr(Config, "TRUST_FORWARDED_FOR", True)
+    monkeypatch.setattr(Config, "TRUSTED_PROXY_HOPS", 1)
+    requests = [_request("/stream/1", f"198.51.100.{i}") for i in range(50)]
+    assert client_ip(requests[0]) == "198.51.100.0"
+    controller, statuses = _hold_streams(monkeypatch, requests)
+    assert statuses == [200] * 50
+    assert not controller.shed
+
+
+def test_requests_without_trusted_address_skip_per_ip_cap(monkeypatch):
+    monkeypatch.setattr(Config, "TRUST_FORWARDED_FOR", True)
+    requests = [_request("/stream/1") for _ in range(50)]
+    assert client_ip(requests[0]) is None
+    controller, statuses = _hold_streams(monkeypatch, requests)
+    assert statuses == [200] * 50
+    assert controller.stats()["clients"] == 0
+
+
+def test_one_viewer_is_still_capped(monkeypatch):
+    monkeypatch.setattr(Config, "TRUST_FORWARDED_FOR", True)
+    monkeypatch.setattr(Config, "TRUSTED_PROXY_HOPS", 1)
+    requests = [_request("/stream/1", "203.0.113.9") for _ in range(5)]
+    controller, statuses = _hold_streams(monkeypatch, requests)
+    assert statuses.count(200) == 2
+    assert controller.shed["stream_per_ip"] == 3
@@ -0,0 +1,60 @@
+import time
+import asyncio
+import pytest
+
+for module in ("motor", "pyrogram"):
+    pytest.importorskip(module)
+from util import bandwidth as bandwidth_module
+from util.bandwidth import BandwidthScheduler, MIN_OWNER_RATE
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    async def get_user(owner_id):
+        return {}
+
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(bandwidth_module, "get_user", get_user)
+    monkeypatch.setattr(bandwidth_module, "REBALANCE_INTERVAL", 0.05)
+    monkeypatch.setattr(bandwidth_module.asyncio, "sleep", no_sleep)
+    return BandwidthScheduler(3 * MB)
+
+
+def _rates(scheduler) -> dict:
+    return {o.owner_id: o.bucket.rate for o in scheduler._owners.values()}
+
+
+def test_idle_owner_share_goes_to_backlogged_owners(scheduler):
+    async def run():
+        leases = {owner: await scheduler.open(owner, None) for owner in ("idle", "busy1", "busy2")}
+        assert _rates(scheduler) == {"idle": MB, "busy1": MB, "busy2": MB}
+        for _ in range(4):
+            await leases["busy1"].consume(MB)
+            await leases["busy2"].consume(MB)
+        time.sleep(0.06)
+        await leases["busy1"].consume(1024)
+        return _rates(scheduler)
+
+    rates = asyncio.run(run())
+    assert rates["idle"] == MIN_OWNER_RATE
+    assert rates["busy1"] > MB and rates["busy2"] > MB
+    assert rates["busy1"] == pytest.approx(rates["busy2"])
+    assert sum(rates.values()) == pytest.approx(3 * MB)
+
+
+def test_owners_all_backlogged_split_evenly(scheduler):
+    async def run():
+        leases = [await scheduler.open(owner, None) for owner in ("a", "b")]
+        for _ in range(4):
+            for lease in leases:
+                await lease.consume(MB)
+        time.sleep(0.06)
+        await leases[0].consume(1024)
+        return _rates(scheduler)
+
+    rates = asyncio.run(run())
+    assert rates == {"a": pytest.approx(1.5 * MB), "b": pytest.approx(1.5 * MB)}
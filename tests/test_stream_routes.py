@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+
+for module in ("aiohttp", "pyrogram", "motor", "jinja2"):
+    pytest.importorskip(module)
+from aiohttp.test_utils import make_mocked_request
+from server import stream_routes
+from util import custom_dl
+from util.client_pool import client_pool
+from util.probe_cache import probe_cache
+from config import Config
+
+RECORD = {
+    "stream_id": 42,
+    "file_name": "movie.mkv",
+    "file_unique_id": "AgADxyz",
+    "stream_location": {
+        "chat_id": -100,
+        "dc_id": 4,
+        "media_id": 1,
+        "access_hash": 2,
+        "file_reference": b"ref",
+        "file_size": 10 * 1024 * 1024,
+        "mime_type": "video/x-matroska",
+        "date": 1700000000,
+    },
+}
+
+
+@pytest.fixture
+def no_client_io(monkeypatch):
+    async def get_file_by_stream_id(message_id):
+        return RECORD if message_id == RECORD["stream_id"] else None
+
+    def acquire():
+        raise AssertionError("a client was acquired")
+
+    monkeypatch.setattr(custom_dl, "get_file_by_stream_id", get_file_by_stream_id)
+    monkeypatch.setattr(client_pool, "acquire", acquire)
+    custom_dl.stream_file_cache.invalidate((None, RECORD["stream_id"]))
+
+
+def _run(handler, method, headers=None):
+    request = make_mocked_request(method, "/stream/42", headers=headers or {}, match_info={"message_id": "42"})
+    return asyncio.run(handler(request))
+
+
+@pytest.mark.parametrize("handler", [stream_routes.stream_handler, stream_routes.download_handler])
+def test_head_needs_no_client(no_client_io, handler):
+    response = _run(handler, "HEAD")
+    assert response.status == 200
+    assert response.headers["Content-Length"] == str(10 * 1024 * 1024)
+
+
+def test_head_range_needs_no_client(no_client_io):
+    response = _run(stream_routes.stream_handler, "HEAD", {"Range": "bytes=0-1023"})
+    assert response.status == 206
+    assert response.headers["Content-Range"] == f"bytes 0-1023/{10 * 1024 * 1024}"
+
+
+def test_cached_probe_needs_no_client(no_client_io):
+    window = bytes(range(256)) * (Config.PROBE_WINDOW // 256)
+    probe_cache.set((RECORD["file_unique_id"], "head"), window)
+    try:
+        response = _run(stream_routes.stream_handler, "GET", {"Range": "bytes=0-15"})
+    finally:
+        probe_cache.invalidate((RECORD["file_unique_id"], "head"))
+    assert response.status == 206
+    assert response.body == window[:16]
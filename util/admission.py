@@ -0,0 +1,131 @@
+# util/admission.py
+
+import logging
+from collections import Counter
+from aiohttp import web
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+STREAM_PREFIXES = ("/stream/", "/download/", "/zip/")
+PAGE_PREFIXES = ("/watch/",)
+
+
+def client_ip(request) -> str | None:
+    """
+    The viewer's address. Behind trusted proxies it is the X-Forwarded-For
+    entry TRUSTED_PROXY_HOPS from the right: proxies append, so anything to
+    the left of that was written by the client and can't be trusted.
+    None when there is no trusted address: the socket address behind a proxy
+    is the proxy's own and is shared by every viewer.
+    """
+    if Config.TRUST_FORWARDED_FOR and Config.TRUSTED_PROXY_HOPS > 0:
+        hops = [h.strip() for h in request.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+        return hops[-min(Config.TRUSTED_PROXY_HOPS, len(hops))] if hops else None
+    return request.remote
+
+
+class AdmissionController:
+    """
+    Caps concurrent media responses globally and per client IP. Requests
+    without a trusted client address only count towards the global cap.
+
+    Over a cap the request is refused with 503 + Retry-After instead of
+    sharing the upstream slots with everyone. /watch pages are counted
+    separately and never compete with streams, so a viewer can still load
+    the player while new streams are being shed.
+    """
+
+    def __init__(self, max_streams: int, max_per_ip: int, max_pages: int):
+        self.max_streams = max_streams
+        self.max_per_ip = max_per_ip
+        self.max_pages = max_pages
+        self.streams = 0
+        self.pages = 0
+        self.peak = 0
+        self._per_ip = Counter()
+        self.admitted = Counter()
+        self.shed = Counter()
+
+    def admit_stream(self, ip: str | None) -> str | None:
+        """Takes a stream slot for `ip`; returns the shed reason when over a cap."""
+        if self.max_streams and self.streams >= self.max_streams:
+            return "global"
+        if ip is not None and self.max_per_ip and self._per_ip[ip] >= self.max_per_ip:
+            return "per_ip"
+        self.streams += 1
+        if ip is not None:
+            self._per_ip[ip] += 1
+        self.peak = max(self.peak, self.streams)
+        return None
+
+    def release_stream(self, ip: str | None):
+        self.streams -= 1
+        if ip is None:
+            return
+        self._per_ip[ip] -= 1
+        if self._per_ip[ip] <= 0:
+            del self._per_ip[ip]
+
+    def admit_page(self) -> str | None:
+        if self.max_pages and self.pages >= self.max_pages:
+            return "pages"
+        self.pages += 1
+        return None
+
+    def release_page(self):
+        self.pages -= 1
+
+    def stats(self) -> dict:
+        return {
+            'streams': self.streams,
+            'max_streams': self.max_streams,
+            'pages': self.pages,
+            'peak': self.peak,
+            'clients': len(self._per_ip),
+            'admitted': dict(self.admitted),
+            'shed': dict(self.shed),
+        }
+
+
+admission = AdmissionController(
+    Config.ADMISSION_MAX_STREAMS, Config.ADMISSION_MAX_STREAMS_PER_IP, Config.ADMISSION_MAX_PAGES
+)
+
+
+def _shed_response() -> web.Response:
+    return web.Response(
+        status=503,
+        text="Server busy, please retry shortly.",
+        headers={"Retry-After": str(Config.ADMISSION_RETRY_AFTER)}
+    )
+
+
+@web.middleware
+async def admission_middleware(request, handler):
+    path = request.path
+    if path.startswith(STREAM_PREFIXES):
+        ip = client_ip(request)
+        reason = admission.admit_stream(ip)
+        if reason:
+            admission.shed[f"stream_{reason}"] += 1
+            logger.info(f"Shedding {path} for {ip}: {reason} stream cap reached")
+            return _shed_response()
+        admission.admitted['stream'] += 1
+        try:
+            return await handler(request)
+        finally:
+            admission.release_stream(ip)
+
+    if path.startswith(PAGE_PREFIXES):
+        reason = admission.admit_page()
+        if reason:
+            admission.shed['watch'] += 1
+            return _shed_response()
+        admission.admitted['watch'] += 1
+        try:
+            return await handler(request)
+        finally:
+            admission.release_page()
+
+    return await handler(request)
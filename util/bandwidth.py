@@ -0,0 +1,265 @@
+# util/bandwidth.py
+
+import time
+import asyncio
+import logging
+from collections import Counter
+from config import Config
+from database.db import get_user, add_stream_usage
+from util.cache import AsyncLRUCache
+
+logger = logging.getLogger(__name__)
+
+# A bucket always holds at least this much burst so one part never waits on itself.
+MIN_BURST = 2 * 1024 * 1024
+
+# Owner rate settings are re-read from the users collection this often (seconds).
+owner_settings = AsyncLRUCache(1024, 300, 300)
+
+# Seconds of traffic each owner's demand is measured over before shares are recomputed.
+REBALANCE_INTERVAL = 1.0
+# An owner that kept up with its bucket is given this much more than it used, so
+# it can grow; one that had to wait is backlogged and takes its full share.
+DEMAND_HEADROOM = 1.25
+# Smallest rate an idle owner is left with (0 would mean unlimited).
+MIN_OWNER_RATE = 64 * 1024
+
+
+class TokenBucket:
+    """
+    Token bucket that may go into debt: a reservation larger than the
+    available tokens is granted and the caller sleeps the debt off. Concurrent
+    callers queue behind each other in reservation order.
+    """
+
+    def __init__(self, rate: float = 0):
+        self.rate = 0
+        self.burst = MIN_BURST
+        self.tokens = MIN_BURST
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        self._refill()
+        self.rate = rate
+        self.burst = max(rate, MIN_BURST)
+        self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, size: int) -> float:
+        """Takes `size` tokens; returns how long the caller must wait (0 when unlimited)."""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        self.tokens -= size
+        return max(0.0, -self.tokens / self.rate)
+
+
+class _Owner:
+    def __init__(self, owner_id, weight: float, limit: int):
+        self.owner_id = owner_id
+        self.weight = weight
+        self.limit = limit
+        self.bucket = TokenBucket()
+        self.leases = 0
+        # Demand over the current sample window; usage is None until one has closed.
+        self.sent = 0
+        self.waited = False
+        self.sampled = time.monotonic()
+        self.usage = None
+        self.backlogged = True
+
+    def sample(self, now: float):
+        elapsed = now - self.sampled
+        if elapsed < REBALANCE_INTERVAL:
+            return
+        self.usage = self.sent / elapsed
+        self.backlogged = self.waited
+        self.sent, self.waited, self.sampled = 0, False, now
+
+    def demand(self) -> float:
+        """Rate this owner can use: unbounded while backlogged, else what it used plus headroom."""
+        if self.backlogged or self.usage is None:
+            wanted = float("inf")
+        else:
+            wanted = max(self.usage * DEMAND_HEADROOM, MIN_OWNER_RATE)
+        return min(wanted, self.limit) if self.limit else wanted
+
+
+class _Client:
+    def __init__(self, rate: int):
+        self.bucket = TokenBucket(rate)
+        self.leases = 0
+
+
+class Lease:
+    """One response's share of its owner's and client's buckets."""
+
+    def __init__(self, scheduler, owner: _Owner, client_key: str | None, client: _Client):
+        self._scheduler = scheduler
+        self.owner = owner
+        self.client_key = client_key
+        self.client = client
+        self.throttled = 0.0
+
+    async def consume(self, size: int):
+        """Waits until `size` more bytes may be written for this response."""
+        owner_delay = self.owner.bucket.reserve(size)
+        delay = max(owner_delay, self.client.bucket.reserve(size))
+        self.owner.sent += size
+        self.owner.waited = self.owner.waited or owner_delay > 0
+        self._scheduler.record_bytes(self.owner.owner_id, size)
+        self._scheduler.maybe_rebalance()
+        if delay > 0:
+            self.throttled += delay
+            self._scheduler.throttled_seconds += delay
+            await asyncio.sleep(delay)
+
+
+class BandwidthScheduler:
+    """
+    Weighted fair sharing of egress between storage owners, plus an optional
+    per-client cap. Responses without a known client address get an unshared,
+    uncapped client bucket rather than one bucket for everyone.
+
+    Every owner with active responses gets a token bucket whose rate comes
+    from a weighted max-min (water-filling) split of STREAM_EGRESS_LIMIT,
+    capped by the owner's own limit: owners that used less than their
+    weighted share keep what they used plus headroom, and the rest goes to
+    the backlogged owners by weight. Shares are recomputed whenever an owner
+    starts or stops streaming and every REBALANCE_INTERVAL while bytes flow,
+    so idle owners don't hold back busy ones. Bytes written are accounted
+    per owner and flushed to the stream_usage collection in batches.
+    """
+
+    def __init__(self, egress_limit: int):
+        self.egress_limit = egress_limit
+        self._owners = {}
+        self._clients = {}
+        self._pending_usage = Counter()
+        self._rebalanced = time.monotonic()
+        self.bytes_by_owner = Counter()
+        self.throttled_seconds = 0.0
+        self.flushes = 0
+
+    async def _settings(self, owner_id) -> tuple:
+        async def load():
+            user = await get_user(owner_id) if owner_id is not None else None
+            user = user or {}
+            # An owner's own /bandwidth limit is split across web workers like the defaults.
+            own_limit = int(user.get('stream_rate_limit') or 0)
+            return (
+                float(user.get('stream_weight') or 1),
+                -(-own_limit // Config.WEB_WORKER_COUNT) if own_limit else Config.STREAM_OWNER_RATE_LIMIT
+            )
+        try:
+            return await owner_settings.get_or_load(owner_id, load)
+        except Exception as e:
+            logger.warning(f"Could not load bandwidth settings for owner {owner_id}: {e}")
+            return 1.0, Config.STREAM_OWNER_RATE_LIMIT
+
+    def maybe_rebalance(self):
+        if time.monotonic() - self._rebalanced >= REBALANCE_INTERVAL:
+            self._rebalance()
+
+    def _rebalance(self):
+        now = self._rebalanced = time.monotonic()
+        owners = list(self._owners.values())
+        for owner in owners:
+            owner.sample(now)
+        if not self.egress_limit:
+            for owner in owners:
+                owner.bucket.set_rate(owner.limit)
+            return
+
+        # Satisfy owners in order of demand per weight while their demand fits
+        # their weighted share of what is left; the others split the remainder.
+        demands = {owner: owner.demand() for owner in owners}
+        pending = sorted(owners, key=lambda o: demands[o] / o.weight)
+        remaining = self.egress_limit
+        rates = {}
+        while pending:
+            owner = pending[0]
+            share = remaining * owner.weight / sum(o.weight for o in pending)
+            if demands[owner] > share:
+                break
+            rates[owner] = demands[owner]
+            remaining -= demands[owner]
+            pending.pop(0)
+        # With everyone satisfied the spare is spread too, up to each owner's limit.
+        receivers = pending or owners
+        total_weight = sum(o.weight for o in receivers)
+        for owner in receivers:
+            extra = remaining * owner.weight / total_weight
+            rates[owner] = rates.get(owner, 0) + extra
+            if owner.limit:
+                rates[owner] = min(rates[owner], owner.limit)
+        for owner, rate in rates.items():
+            owner.bucket.set_rate(max(rate, 1.0))
+
+    async def open(self, owner_id, client_key: str | None) -> Lease:
+        weight, limit = await self._settings(owner_id)
+        owner = self._owners.get(owner_id)
+        if owner is None:
+            owner = self._owners[owner_id] = _Owner(owner_id, weight, limit)
+        owner.weight, owner.limit = weight, limit
+        owner.leases += 1
+        if client_key is None:
+            client = _Client(0)
+        else:
+            client = self._clients.get(client_key)
+            if client is None:
+                client = self._clients[client_key] = _Client(Config.STREAM_CLIENT_RATE_LIMIT)
+        client.leases += 1
+        self._rebalance()
+        return Lease(self, owner, client_key, client)
+
+    def close(self, lease: Lease):
+        lease.owner.leases -= 1
+        if lease.owner.leases <= 0:
+            self._owners.pop(lease.owner.owner_id, None)
+            self._rebalance()
+        lease.client.leases -= 1
+        if lease.client.leases <= 0 and lease.client_key is not None:
+            self._clients.pop(lease.client_key, None)
+
+    def record_bytes(self, owner_id, size: int):
+        if owner_id is None:
+            return
+        self._pending_usage[owner_id] += size
+        self.bytes_by_owner[owner_id] += size
+
+    async def flush_usage(self):
+        """Writes the bytes accumulated since the last flush to Mongo."""
+        if not self._pending_usage:
+            return
+        batch, self._pending_usage = self._pending_usage, Counter()
+        try:
+            await add_stream_usage(dict(batch))
+            self.flushes += 1
+        except Exception as e:
+            logger.error(f"Failed to flush stream usage for {len(batch)} owners: {e}")
+            self._pending_usage.update(batch)
+
+    async def run_usage_flusher(self):
+        while True:
+            await asyncio.sleep(Config.STREAM_USAGE_FLUSH_INTERVAL)
+            await self.flush_usage()
+
+    def stats(self, limit: int = 3) -> dict:
+        return {
+            'egress_limit': self.egress_limit,
+            'active_owners': len(self._owners),
+            'active_clients': len(self._clients),
+            'throttled_seconds': round(self.throttled_seconds, 1),
+            'top_owners': self.bytes_by_owner.most_common(limit),
+            'owner_rates': {o.owner_id: round(o.bucket.rate) for o in self._owners.values()},
+        }
+
+
+bandwidth = BandwidthScheduler(Config.STREAM_EGRESS_LIMIT)
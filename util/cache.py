@@ -0,0 +1,89 @@
+# util/cache.py
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class AsyncLRUCache:
+    """
+    Bounded LRU with per-entry TTL for async lookups.
+
+    - Positive results live for `ttl` seconds, `None` results for `negative_ttl`.
+    - Concurrent misses for the same key share one in-flight loader call.
+    - Exceptions are never cached; every waiter of that load sees the error.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def peek(self, key, default=None):
+        """Returns a live cached value without loading or touching LRU order."""
+        entry = self._data.get(key)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return default
+
+    def set(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    async def get_or_load(self, key, loader):
+        entry = self._data.get(key)
+        if entry:
+            value, expires = entry
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                if value is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return value
+            del self._data[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._on_loaded(k, t))
+
+        # Shielded so one cancelled requester doesn't abort the load for the rest.
+        return await asyncio.shield(task)
+
+    def _on_loaded(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.set(key, task.result())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_ratio': round((self.hits + self.negative_hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
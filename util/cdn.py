@@ -0,0 +1,115 @@
+# util/cdn.py
+
+import hashlib
+from collections import OrderedDict
+from pyrogram.crypto import aes
+
+# Redirect state is per file; this many files are remembered.
+MAX_TRACKED_FILES = 2048
+
+
+class CdnHashMismatch(Exception):
+    pass
+
+
+class CdnFile:
+    """
+    State of one upload.FileCdnRedirect: where the encrypted copy lives, how to
+    decrypt it, and the sha256 of each verified piece (keyed by piece offset).
+    """
+
+    def __init__(self, redirect):
+        self.dc_id = redirect.dc_id
+        self.file_token = redirect.file_token
+        self.encryption_key = redirect.encryption_key
+        self.encryption_iv = redirect.encryption_iv
+        self.hashes = {}
+        self.add_hashes(redirect.file_hashes)
+
+    def add_hashes(self, file_hashes):
+        for file_hash in file_hashes or []:
+            self.hashes[file_hash.offset] = file_hash
+
+    def decrypt(self, data: bytes, offset: int) -> bytes:
+        # AES-256-CTR; the last 4 IV bytes are the big-endian block index of `offset`.
+        iv = bytearray(self.encryption_iv[:-4] + (offset // 16).to_bytes(4, "big"))
+        return aes.ctr256_decrypt(data, self.encryption_key, iv)
+
+    def missing_hash_offset(self, offset: int, length: int) -> int | None:
+        """First piece offset inside [offset, offset+length) we have no hash for."""
+        position = offset
+        while position < offset + length:
+            file_hash = self.hashes.get(position)
+            if file_hash is None:
+                return position
+            position += file_hash.limit
+        return None
+
+    def verify(self, data: bytes, offset: int):
+        position = offset
+        view = memoryview(data)
+        while position < offset + len(data):
+            file_hash = self.hashes[position]
+            piece = view[position - offset:position - offset + file_hash.limit]
+            if hashlib.sha256(piece).digest() != file_hash.hash:
+                raise CdnHashMismatch(f"CDN piece at offset {position} failed sha256 verification")
+            position += file_hash.limit
+
+
+class CdnRegistry:
+    """Which files are served through a CDN DC, and which must avoid it."""
+
+    def __init__(self):
+        self._files = OrderedDict()
+        self._disabled = OrderedDict()
+        self.redirects = 0
+        self.parts = 0
+        self.bytes = 0
+        self.reuploads = 0
+        self.fallbacks = 0
+
+    def get(self, file_key: str) -> CdnFile | None:
+        cdn_file = self._files.get(file_key)
+        if cdn_file:
+            self._files.move_to_end(file_key)
+        return cdn_file
+
+    def register(self, file_key: str, redirect) -> CdnFile:
+        cdn_file = CdnFile(redirect)
+        self._files[file_key] = cdn_file
+        self._files.move_to_end(file_key)
+        while len(self._files) > MAX_TRACKED_FILES:
+            self._files.popitem(last=False)
+        self.redirects += 1
+        return cdn_file
+
+    def forget(self, file_key: str):
+        self._files.pop(file_key, None)
+
+    def disable(self, file_key: str):
+        """Serve this file from its main DC from now on (CDN broken or tampered)."""
+        self._files.pop(file_key, None)
+        self._disabled[file_key] = True
+        while len(self._disabled) > MAX_TRACKED_FILES:
+            self._disabled.popitem(last=False)
+        self.fallbacks += 1
+
+    def is_disabled(self, file_key: str) -> bool:
+        return file_key in self._disabled
+
+    def record_part(self, size: int):
+        self.parts += 1
+        self.bytes += size
+
+    def stats(self) -> dict:
+        return {
+            'files': len(self._files),
+            'redirects': self.redirects,
+            'parts': self.parts,
+            'bytes': self.bytes,
+            'reuploads': self.reuploads,
+            'fallbacks': self.fallbacks,
+        }
+
+
+cdn_registry = CdnRegistry()
@@ -0,0 +1,336 @@
+# util/chunk_cache.py
+
+import os
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+INDEX_FLUSH_INTERVAL = 30
+
+
+class CachedPart:
+    """
+    A byte slice of a part file on disk, handed to the web tier so it can be
+    written with sendfile. Holds an open file object: the data stays readable
+    even if the part is evicted meanwhile. Callers must close() it, and
+    call served() once the slice has actually gone out.
+    """
+
+    def __init__(self, file, offset: int, length: int, cache: "ChunkCache | None" = None):
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.cache = cache
+
+    def __len__(self):
+        return self.length
+
+    def slice(self, start: int, stop: int | None = None) -> "CachedPart":
+        stop = self.length if stop is None else min(stop, self.length)
+        return CachedPart(self.file, self.offset + start, max(stop - start, 0), self.cache)
+
+    def served(self):
+        """Counts this slice (not the whole part) as bytes the cache saved."""
+        if self.cache is not None:
+            self.cache.bytes_saved += self.length
+
+    def close(self):
+        try:
+            self.file.close()
+        except OSError:
+            pass
+
+
+class ChunkCache:
+    """
+    Disk cache of aligned stream parts keyed by (file unique id, part index).
+
+    Parts are written to a temp file and renamed into place, so a crash never
+    leaves a torn part behind. An LRU index (key -> size) is kept in memory and
+    flushed to `index.json` periodically; on start it is reconciled with what
+    is actually on disk.
+
+    Parts can also be pinned (pre-warmed heads/tails of new uploads). Pinned
+    parts live in a separate tier with its own `pin_max_bytes` budget, so
+    general LRU traffic can never push them out.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, part_size: int, pin_max_bytes: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.pin_max_bytes = pin_max_bytes
+        self.part_size = part_size
+        self.enabled = max_bytes > 0
+        self._entries = OrderedDict()
+        self._pinned = OrderedDict()
+        self.pinned_size = 0
+        self._writing = set()
+        self._dirty = False
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_stored = 0
+        self.evictions = 0
+        self.pin_evictions = 0
+        self.write_errors = 0
+
+    # ---------- paths ----------
+
+    @staticmethod
+    def _key(file_key: str, part: int) -> str:
+        return f"{file_key}/{part}"
+
+    def _path(self, key: str) -> str:
+        file_key, part = key.split("/")
+        return os.path.join(self.directory, file_key, f"{part}.part")
+
+    # ---------- startup / persistence ----------
+
+    def load(self):
+        """Rebuilds the in-memory index from index.json and the files on disk."""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        on_disk = {}
+        for file_key in os.listdir(self.directory):
+            file_dir = os.path.join(self.directory, file_key)
+            if not os.path.isdir(file_dir):
+                continue
+            for name in os.listdir(file_dir):
+                path = os.path.join(file_dir, name)
+                if not name.endswith(".part"):
+                    # Leftover temp file from an interrupted write
+                    try: os.remove(path)
+                    except OSError: pass
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                on_disk[self._key(file_key, name[:-5])] = (stat.st_size, stat.st_mtime)
+
+        ordered, pinned = [], []
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), "r") as f:
+                index = json.load(f)
+            ordered, pinned = index.get("entries", []), index.get("pinned", [])
+        except (OSError, ValueError):
+            logger.warning("Chunk cache index missing or unreadable; rebuilding from disk.")
+
+        for key, _ in pinned:
+            if key in on_disk:
+                self._pinned[key] = on_disk.pop(key)[0]
+        # Known entries keep their LRU order; parts written after the last flush go last.
+        for key, _ in ordered:
+            if key in on_disk:
+                self._entries[key] = on_disk.pop(key)[0]
+        for key, (size, _) in sorted(on_disk.items(), key=lambda item: item[1][1]):
+            self._entries[key] = size
+
+        self.size = sum(self._entries.values())
+        self.pinned_size = sum(self._pinned.values())
+        self._evict()
+        self._evict_pinned()
+        self._dirty = True
+        logger.info(
+            f"Chunk cache loaded: {len(self._entries)} parts, {self.size} bytes "
+            f"(+{len(self._pinned)} pinned, {self.pinned_size} bytes) in {self.directory}"
+        )
+
+    def _write_index(self, entries: list, pinned: list):
+        path = os.path.join(self.directory, INDEX_FILE)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"part_size": self.part_size, "entries": entries, "pinned": pinned}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    async def flush_index(self):
+        if not self.enabled or not self._dirty:
+            return
+        self._dirty = False
+        entries = list(self._entries.items())
+        pinned = list(self._pinned.items())
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_index, entries, pinned)
+        except OSError as e:
+            self._dirty = True
+            logger.error(f"Could not write chunk cache index: {e}")
+
+    async def run_index_flusher(self):
+        while True:
+            await asyncio.sleep(INDEX_FLUSH_INTERVAL)
+            await self.flush_index()
+
+    # ---------- lookups ----------
+
+    def contains(self, file_key: str, part: int) -> bool:
+        key = self._key(file_key, part)
+        return self.enabled and (key in self._entries or key in self._pinned)
+
+    def is_pinned(self, file_key: str, part: int) -> bool:
+        return self.enabled and self._key(file_key, part) in self._pinned
+
+    async def open_part(self, file_key: str, part: int) -> CachedPart | None:
+        """Opens a cached part for serving, counting the hit or miss."""
+        if not self.enabled:
+            return None
+        key = self._key(file_key, part)
+        size = self._pinned.get(key)
+        if size is None:
+            size = self._entries.get(key)
+        if size is None:
+            self.misses += 1
+            return None
+        try:
+            file = await asyncio.get_running_loop().run_in_executor(None, open, self._path(key), "rb")
+        except OSError:
+            self._drop(key)
+            self.misses += 1
+            return None
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._dirty = True
+        self.hits += 1
+        return CachedPart(file, 0, size, self)
+
+    async def read(self, part: CachedPart) -> bytes:
+        """The slice's bytes in memory; closes the part and counts it as served."""
+        def _read():
+            part.file.seek(part.offset)
+            return part.file.read(part.length)
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, _read)
+        finally:
+            part.close()
+        part.served()
+        return data
+
+    # ---------- writes ----------
+
+    def _write_part(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    async def store(self, file_key: str, part: int, data: bytes, pinned: bool = False):
+        if pinned and self.pin(file_key, part):
+            return
+        budget = self.pin_max_bytes if pinned else self.max_bytes
+        if not self.enabled or len(data) > budget:
+            return
+        key = self._key(file_key, part)
+        if key in self._entries or key in self._pinned or key in self._writing:
+            return
+
+        self._writing.add(key)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_part, self._path(key), data)
+        except OSError as e:
+            self.write_errors += 1
+            logger.warning(f"Chunk cache write failed for {key}: {e}")
+            return
+        finally:
+            self._writing.discard(key)
+
+        self.bytes_stored += len(data)
+        self._dirty = True
+        if pinned:
+            self._pinned[key] = len(data)
+            self.pinned_size += len(data)
+            self._evict_pinned()
+        else:
+            self._entries[key] = len(data)
+            self.size += len(data)
+            self._evict()
+
+    def store_later(self, file_key: str, part: int, data: bytes):
+        """Fire-and-forget store, so the stream never waits on disk."""
+        if not self.contains(file_key, part) and self.enabled:
+            asyncio.create_task(self.store(file_key, part, data))
+
+    def pin(self, file_key: str, part: int) -> bool:
+        """Moves an already cached part into the pinned tier; False if it isn't cached."""
+        key = self._key(file_key, part)
+        if key in self._pinned:
+            return True
+        size = self._entries.pop(key, None)
+        if size is None or size > self.pin_max_bytes:
+            if size is not None:
+                self._entries[key] = size
+            return False
+        self.size -= size
+        self._pinned[key] = size
+        self.pinned_size += size
+        self._dirty = True
+        self._evict_pinned()
+        return True
+
+    # ---------- eviction ----------
+
+    def _drop(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self.size -= size
+        else:
+            size = self._pinned.pop(key, None)
+            if size is None:
+                return
+            self.pinned_size -= size
+        self._dirty = True
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self.evictions += 1
+
+    def _evict_pinned(self):
+        # Oldest pins go first: the newest uploads are the ones about to be watched.
+        while self.pinned_size > self.pin_max_bytes and self._pinned:
+            key = next(iter(self._pinned))
+            self._drop(key)
+            self.pin_evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'parts': len(self._entries),
+            'size': self.size,
+            'max_bytes': self.max_bytes,
+            'pinned_parts': len(self._pinned),
+            'pinned_size': self.pinned_size,
+            'pin_max_bytes': self.pin_max_bytes,
+            'pin_evictions': self.pin_evictions,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+            'bytes_saved': self.bytes_saved,
+            'bytes_stored': self.bytes_stored,
+            'evictions': self.evictions,
+            'write_errors': self.write_errors,
+        }
+
+
+chunk_cache = ChunkCache(Config.CHUNK_CACHE_DIR, Config.CHUNK_CACHE_BYTES, 1024 * 1024, Config.CHUNK_CACHE_PIN_BYTES)
+# Parts holding container indexes (MP4 moov, MKV Cues); see util.media_index.
+index_cache = ChunkCache(Config.INDEX_CACHE_DIR, Config.INDEX_CACHE_BYTES, 1024 * 1024)
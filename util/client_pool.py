@@ -0,0 +1,158 @@
+# util/client_pool.py
+
+import time
+import logging
+from contextlib import asynccontextmanager
+from pyrogram import Client
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Recent FloodWaits weigh on a client's score for this long (half-life, seconds).
+FLOOD_DECAY_HALF_LIFE = 300
+
+
+class StreamClient(Client):
+    """
+    Client used only to download media for the web tier. Never handles updates.
+    Logs in with a helper bot token, or reuses an exported session string.
+    """
+
+    def __init__(self, index: int, bot_token: str | None = None, session_string: str | None = None, name: str = "StreamHelper"):
+        super().__init__(
+            f"{name}{index}",
+            api_id=Config.API_ID,
+            api_hash=Config.API_HASH,
+            bot_token=bot_token,
+            session_string=session_string,
+            no_updates=True,
+            in_memory=True
+        )
+        self.owner_db_channel = Config.OWNER_DB_CHANNEL
+        self.stream_channel_id = None
+
+
+class _PoolMember:
+    def __init__(self, name: str, client: Client, primary: bool):
+        self.name = name
+        self.client = client
+        # The main bot's identity: the location saved at ingest is only valid for it.
+        self.primary = primary
+        self.active = 0
+        self.served = 0
+        self.flood_waits = 0
+        self.flood_until = 0.0
+        self._flood_score = 0.0
+        self._flood_stamp = time.monotonic()
+
+    @property
+    def flood_score(self) -> float:
+        elapsed = time.monotonic() - self._flood_stamp
+        return self._flood_score * 0.5 ** (elapsed / FLOOD_DECAY_HALF_LIFE)
+
+    def add_flood(self, seconds: int):
+        self._flood_score = self.flood_score + 1
+        self._flood_stamp = time.monotonic()
+        self.flood_until = max(self.flood_until, time.monotonic() + seconds)
+        self.flood_waits += 1
+
+    @property
+    def in_rotation(self) -> bool:
+        return self.flood_until <= time.monotonic()
+
+    def load(self) -> float:
+        return self.active + Config.FLOOD_WAIT_PENALTY * self.flood_score
+
+
+class ClientPool:
+    """
+    The set of clients allowed to download media for /stream and /download.
+    The main bot is always a member; extra helper bots come from MULTI_TOKENS.
+    """
+
+    def __init__(self):
+        self.members = []
+
+    def add(self, name: str, client: Client, primary: bool = False):
+        self.members.append(_PoolMember(name, client, primary))
+
+    async def start_helpers(self, tokens: list):
+        for index, token in enumerate(tokens, start=1):
+            await self._start_member(index, StreamClient(index, bot_token=token))
+
+    async def start_sessions(self, session_strings: list, name: str):
+        """Adds download-only copies of already authorized sessions (used by web workers)."""
+        # The first session is the main bot's own; the rest are helper bots.
+        for index, session_string in enumerate(session_strings):
+            await self._start_member(index, StreamClient(index, session_string=session_string, name=name), primary=index == 0)
+
+    async def _start_member(self, index: int, helper: StreamClient, primary: bool = False):
+        try:
+            await helper.start()
+            me = await helper.get_me()
+            if helper.owner_db_channel:
+                # Helpers must be members of the Owner DB channel to read its files.
+                await helper.get_chat(int(helper.owner_db_channel))
+            self.add(f"@{me.username}", helper, primary)
+            logger.info(f"Stream helper @{me.username} joined the client pool.")
+        except Exception as e:
+            logger.error(f"Stream helper #{index} failed to start (skipped): {e}")
+            try: await helper.stop()
+            except Exception: pass
+
+    async def stop_helpers(self):
+        for member in self.members:
+            if isinstance(member.client, StreamClient):
+                try: await member.client.stop()
+                except Exception: pass
+
+    def _member(self, client: Client):
+        for member in self.members:
+            if member.client is client:
+                return member
+        return None
+
+    def location_key(self, client: Client) -> str | None:
+        """
+        None for the main bot (and clients outside the pool), whose file
+        locations come from the ingest record; otherwise the helper's name,
+        since a file location can't be moved from one bot to another.
+        """
+        member = self._member(client)
+        return member.name if member and not member.primary else None
+
+    def pick(self) -> _PoolMember:
+        """Least-loaded client in rotation; if all are flood-waited, the one that recovers first."""
+        eligible = [m for m in self.members if m.in_rotation]
+        if eligible:
+            return min(eligible, key=lambda m: (m.load(), m.served))
+        return min(self.members, key=lambda m: m.flood_until)
+
+    @asynccontextmanager
+    async def acquire(self):
+        member = self.pick()
+        member.active += 1
+        member.served += 1
+        try:
+            yield member.client
+        finally:
+            member.active -= 1
+
+    def report_flood(self, client: Client, seconds: int):
+        member = self._member(client)
+        if member:
+            member.add_flood(seconds)
+            logger.warning(f"Stream client {member.name} hit FloodWait {seconds}s; out of rotation until it recovers.")
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        return [{
+            'name': m.name,
+            'active': m.active,
+            'served': m.served,
+            'flood_waits': m.flood_waits,
+            'paused_for': max(0, round(m.flood_until - now)),
+        } for m in self.members]
+
+
+client_pool = ClientPool()
@@ -3,19 +3,62 @@
 import asyncio
 import logging
 import math
+import time
+from collections import deque
+from contextlib import aclosing
 from typing import Union
 from pyrogram import Client, raw, utils
 from pyrogram.file_id import FileId
-from pyrogram.session import Session, Auth
-from pyrogram.errors import AuthBytesInvalid
+from pyrogram.errors import FileReferenceExpired, FloodWait, FileMigrate, Unauthorized, InternalServerError, BadRequest
 # --- LEGENDARY MODIFICATION: Import the renamed function ---
-from util.file_properties import get_message_with_properties, FileIdError
+from util.file_properties import get_message_with_properties, FileIdError, StreamFile
+from database.db import get_file_by_stream_id, update_stream_location
+from util.stream_stats import StreamStats, stream_monitor
+from util.cache import AsyncLRUCache
+from util.chunk_cache import chunk_cache, index_cache, CachedPart
+from util.client_pool import client_pool
+from util.media_session import get_session_manager
+from util.part_share import part_coalescer
+from util.cdn import cdn_registry, CdnFile, CdnHashMismatch
+from util.part_tuner import part_tuner
+from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Telegram serves GetFile in parts whose limit divides 1 MB; 1 MB parts
+# need the fewest round trips per byte.
+PART_SIZE = 1024 * 1024
+
+# Shared across requests: players open many range connections for the same
+# message, and only the first one should pay for the lookup.
+message_cache = AsyncLRUCache(Config.META_CACHE_SIZE, Config.META_CACHE_TTL, Config.META_CACHE_NEGATIVE_TTL)
+stream_file_cache = AsyncLRUCache(Config.META_CACHE_SIZE, Config.META_CACHE_TTL, Config.META_CACHE_NEGATIVE_TTL)
+# Cached StreamFile objects are shared between requests, so reference refreshes are too.
+_refresh_lock = asyncio.Lock()
+# ReuploadCdnFile rounds before a part gives up on the CDN.
+CDN_REUPLOAD_ATTEMPTS = 3
+
+async def stored_stream_file(message_id: int) -> StreamFile | None:
+    """
+    The file as known without asking Telegram: the main bot's cached entry or
+    the location persisted at ingest (which is what the main bot would load).
+    None for records that only a message read can complete.
+    """
+    cached = stream_file_cache.peek((None, message_id))
+    if cached is not None:
+        return cached
+    record = await get_file_by_stream_id(message_id)
+    stored = StreamFile.from_record(record) if record else None
+    if stored:
+        stream_file_cache.set((None, message_id), stored)
+    return stored
+
+
 class ByteStreamer:
     def __init__(self, client: Client):
         self.client: Client = client
+        # Locations and messages are per bot: helpers resolve and cache their own.
+        self.location_key = client_pool.location_key(client)
 
     async def get_file_properties(self, message_id: int):
         """
@@ -23,6 +66,9 @@ class ByteStreamer:
         The name is kept for backward compatibility in other parts of the code,
         but it now fetches the message.
         """
+        return await message_cache.get_or_load((self.location_key, message_id), lambda: self._load_message(message_id))
+
+    async def _load_message(self, message_id: int):
         try:
             # --- LEGENDARY MODIFICATION: Call the renamed function ---
             return await get_message_with_properties(self.client, message_id)
@@ -30,35 +76,83 @@ class ByteStreamer:
             logger.error(f"Failed to get file properties for message_id {message_id}: {e}")
             return None
 
-    async def generate_media_session(self, client: Client, dc_id: int):
-        session = client.media_sessions.get(dc_id)
+    async def get_stream_file(self, message_id: int) -> StreamFile | None:
+        """
+        Resolves a stream message id to its GetFile location.
 
-        if session is None:
-            session = Session(
-                client, dc_id, await Auth(client, dc_id, await client.storage.test_mode()).create(),
-                await client.storage.test_mode(), is_media=True
-            )
-            await session.start()
+        Uses the location persisted at ingest when there is one; otherwise falls
+        back to fetching the channel message once and backfills the record so
+        the next request skips the RPC. Helper bots can't use the main bot's
+        location, so they read the message themselves, keep the record's
+        metadata, and never write the record. Results (including misses) are
+        cached per bot.
+        """
+        return await stream_file_cache.get_or_load(
+            (self.location_key, message_id), lambda: self._load_stream_file(message_id)
+        )
 
-            for i in range(3):
-                exported_auth = await client.invoke(
-                    raw.functions.auth.ExportAuthorization(dc_id=dc_id)
-                )
-                try:
-                    await session.invoke(
-                        raw.functions.auth.ImportAuthorization(
-                            id=exported_auth.id,
-                            bytes=exported_auth.bytes
-                        )
-                    )
-                    break
-                except AuthBytesInvalid:
-                    continue
-            client.media_sessions[dc_id] = session
-        return session
+    async def _load_stream_file(self, message_id: int) -> StreamFile | None:
+        record = await get_file_by_stream_id(message_id)
+        stored = StreamFile.from_record(record) if record else None
+        if stored and self.location_key is None:
+            return stored
+
+        message = await self.get_file_properties(message_id)
+        if not message:
+            return None
+
+        stream_file = StreamFile.from_message(message, owner_id=record.get('owner_id') if record else None)
+        if stream_file and stored:
+            stored.use_location(stream_file)
+            return stored
+        if stream_file and record:
+            # A record saved before locations were persisted: keep all of its
+            # metadata (name, series placement, media index) around the message's location.
+            location = stream_file.location_record()
+            stream_file = StreamFile.from_record({**record, 'stream_location': location})
+            if self.location_key is None:
+                await update_stream_location(message_id, location)
+        return stream_file
+
+    async def located(self, stream_file: StreamFile) -> StreamFile:
+        """`stream_file` as this bot must address it (a helper's own copy of the location)."""
+        if self.location_key is None:
+            return stream_file
+        return await self.get_stream_file(stream_file.message_id) or stream_file
+
+    async def refresh_file_reference(self, stream_file: StreamFile, stale_reference: bytes) -> bool:
+        """
+        Re-reads the channel message after Telegram reported FILE_REFERENCE_EXPIRED
+        and stores the fresh reference. Concurrent callers holding the same stale
+        reference share one refresh.
+        """
+        async with _refresh_lock:
+            if stream_file.file_reference != stale_reference:
+                return True
+
+            try:
+                message = await get_message_with_properties(self.client, stream_file.message_id, stream_file.chat_id)
+            except Exception as e:
+                logger.error(f"Could not re-read message_id {stream_file.message_id} for a fresh file_reference: {e!r}")
+                return False
+            fresh = StreamFile.from_message(message) if message else None
+            if not fresh:
+                logger.error(f"Could not refresh file_reference for message_id {stream_file.message_id}")
+                return False
+
+            stream_file.use_location(fresh)
+            message_cache.invalidate((self.location_key, stream_file.message_id))
+            if self.location_key is None:
+                await update_stream_location(stream_file.message_id, stream_file.location_record())
+            logger.info(f"Refreshed file_reference for message_id {stream_file.message_id}")
+            return True
+
+    async def generate_media_session(self, client: Client, dc_id: int):
+        """Kept for older callers; sessions now come from the per-DC pool."""
+        return await get_session_manager(client).get(dc_id)
 
     @staticmethod
-    def get_location(file_id: FileId):
+    def get_location(file_id: Union[FileId, StreamFile]):
         return raw.types.InputDocumentFileLocation(
             id=file_id.media_id,
             access_hash=file_id.access_hash,
@@ -66,38 +160,321 @@ class ByteStreamer:
             thumb_size=""
         )
 
-    async def yield_file(self, file_id: FileId, offset: int, first_part_cut: int, last_part_cut: int, part_count: int, chunk_size: int):
-        media_session = await self.generate_media_session(self.client, file_id.dc_id)
-        location = self.get_location(file_id)
+    @staticmethod
+    def plan_range(start: int, end: int, chunk_size: int = PART_SIZE):
+        """
+        Maps an inclusive byte range onto aligned GetFile parts.
+        Returns (offset, first_part_cut, last_part_cut, part_count).
+        """
+        offset = start - (start % chunk_size)
+        first_part_cut = start - offset
+        last_part_cut = end % chunk_size + 1
+        part_count = math.ceil((end + 1) / chunk_size) - offset // chunk_size
+        return offset, first_part_cut, last_part_cut, part_count
 
-        current_part = 1
-        while current_part <= part_count:
+    async def _fetch_part(self, stream_file: StreamFile, offset: int, chunk_size: int) -> bytes:
+        """
+        One GetFile call for `offset`, recovered in place so the HTTP response
+        stays open: FloodWaits are waited out, expired file references are
+        refreshed, DC migrations followed, and broken media sessions replaced.
+        Other transient failures are retried with bounded exponential backoff.
+
+        Files Telegram has moved to a CDN DC are read from there once the
+        redirect is known; a CDN that fails verification is dropped for that
+        file and the main DC is used instead.
+        """
+        sessions = get_session_manager(self.client)
+        file_key = stream_file.cache_key
+        attempt = 0
+        while True:
+            file_reference = stream_file.file_reference
+            dc_id = stream_file.dc_id
+            media_session = None
+            backoff = True
             try:
-                chunk = await media_session.invoke(
-                    raw.functions.upload.GetFile(
-                        location=location,
-                        offset=offset,
-                        limit=chunk_size
-                    ),
-                    retries=0
-                )
+                cdn_file = cdn_registry.get(file_key)
+                if cdn_file:
+                    data = await self._fetch_cdn_part(stream_file, cdn_file, offset, chunk_size)
+                    if data is not None:
+                        return data
+
+                async with sessions.session(dc_id) as media_session:
+                    started = time.monotonic()
+                    chunk = await media_session.invoke(
+                        raw.functions.upload.GetFile(
+                            location=self.get_location(stream_file),
+                            offset=offset,
+                            limit=chunk_size,
+                            cdn_supported=Config.STREAM_CDN_ENABLED and not cdn_registry.is_disabled(file_key)
+                        ),
+                        retries=0
+                    )
                 if isinstance(chunk, raw.types.upload.File):
-                    if current_part == 1 and part_count > 1:
-                        yield chunk.bytes[first_part_cut:]
-                    elif current_part == part_count and part_count > 1:
-                        yield chunk.bytes[:last_part_cut]
-                    else:
-                        yield chunk.bytes
-                    
-                    offset += chunk_size
-                    current_part += 1
-                else:
-                    logger.warning(f"Received unexpected type from GetFile: {type(chunk)}")
-                    break
-            except asyncio.TimeoutError:
-                logger.warning("Timeout error while fetching chunk, retrying...")
-                await asyncio.sleep(1) 
+                    if len(chunk.bytes) == chunk_size:
+                        part_tuner.record(dc_id, chunk_size, time.monotonic() - started)
+                    return chunk.bytes
+                if isinstance(chunk, raw.types.upload.FileCdnRedirect):
+                    logger.info(f"Message {stream_file.message_id} redirected to CDN DC{chunk.dc_id}")
+                    cdn_file = cdn_registry.register(file_key, chunk)
+                    data = await self._fetch_cdn_part(stream_file, cdn_file, offset, chunk_size)
+                    if data is not None:
+                        return data
+                    continue
+                raise TypeError(f"Received unexpected type from GetFile: {type(chunk)}")
+
+            except FloodWait as e:
+                # Take this client out of rotation for new streams; this one waits it out.
+                client_pool.report_flood(self.client, e.value)
+                if e.value > Config.STREAM_MAX_FLOOD_SLEEP:
+                    raise
+                stream_monitor.record_recovery("flood_wait")
+                await asyncio.sleep(e.value)
                 continue
-            except Exception as e:
-                logger.error(f"Error yielding file chunk: {e}", exc_info=True)
+            except FileReferenceExpired as e:
+                if not await self.refresh_file_reference(stream_file, file_reference):
+                    raise
+                error, reason, backoff = e, "file_reference", False
+            except FileMigrate as e:
+                logger.info(f"Message {stream_file.message_id} moved from DC{dc_id} to DC{e.value}")
+                stream_file.dc_id = e.value
+                error, reason, backoff = e, "dc_migrate", False
+            except Unauthorized as e:
+                if media_session:
+                    await sessions.discard(dc_id, media_session)
+                error, reason = e, "session"
+            except (asyncio.TimeoutError, OSError, InternalServerError) as e:
+                # A second failure in a row suggests the connection itself is bad.
+                if media_session and attempt:
+                    await sessions.discard(dc_id, media_session)
+                error, reason = e, "transient"
+
+            attempt += 1
+            if attempt > Config.STREAM_RETRY_ATTEMPTS:
+                logger.error(f"Giving up on message {stream_file.message_id} at offset {offset} after {attempt} attempts: {error!r}")
+                raise error
+            stream_monitor.record_recovery(reason)
+            delay = min(Config.STREAM_RETRY_BACKOFF * 2 ** (attempt - 1), 8) if backoff else 0
+            logger.warning(
+                f"GetFile for message {stream_file.message_id} at offset {offset} failed ({reason}: {error!r}); "
+                f"retry {attempt}/{Config.STREAM_RETRY_ATTEMPTS} in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+    async def _fetch_cdn_part(self, stream_file: StreamFile, cdn_file: CdnFile, offset: int, chunk_size: int) -> bytes | None:
+        """
+        GetCdnFile for one part: asks the main DC to reupload when the CDN
+        lacks it, decrypts, and checks every piece against its sha256.
+        Returns None (and disables the CDN for this file) when the CDN cannot
+        be trusted or reached, so the caller goes back to the main DC.
+        """
+        sessions = get_session_manager(self.client)
+        cdn_session = None
+        try:
+            for _ in range(CDN_REUPLOAD_ATTEMPTS):
+                async with sessions.session(cdn_file.dc_id, cdn=True) as cdn_session:
+                    chunk = await cdn_session.invoke(
+                        raw.functions.upload.GetCdnFile(
+                            file_token=cdn_file.file_token,
+                            offset=offset,
+                            limit=chunk_size
+                        ),
+                        retries=0
+                    )
+                if isinstance(chunk, raw.types.upload.CdnFileReuploadNeeded):
+                    async with sessions.session(stream_file.dc_id) as media_session:
+                        hashes = await media_session.invoke(
+                            raw.functions.upload.ReuploadCdnFile(
+                                file_token=cdn_file.file_token,
+                                request_token=chunk.request_token
+                            )
+                        )
+                    cdn_file.add_hashes(hashes)
+                    cdn_registry.reuploads += 1
+                    stream_monitor.record_recovery("cdn_reupload")
+                    continue
                 break
+            else:
+                raise ConnectionError("CDN still wants a reupload")
+
+            data = cdn_file.decrypt(chunk.bytes, offset)
+            missing = cdn_file.missing_hash_offset(offset, len(data))
+            while missing is not None:
+                async with sessions.session(stream_file.dc_id) as media_session:
+                    hashes = await media_session.invoke(
+                        raw.functions.upload.GetCdnFileHashes(file_token=cdn_file.file_token, offset=missing)
+                    )
+                if not hashes:
+                    raise CdnHashMismatch(f"No hashes for CDN piece at offset {missing}")
+                cdn_file.add_hashes(hashes)
+                next_missing = cdn_file.missing_hash_offset(offset, len(data))
+                if next_missing == missing:
+                    raise CdnHashMismatch(f"No hash covers CDN piece at offset {missing}")
+                missing = next_missing
+            cdn_file.verify(data, offset)
+            cdn_registry.record_part(len(data))
+            return data
+
+        except (FloodWait, FileReferenceExpired, FileMigrate):
+            raise
+        except (CdnHashMismatch, BadRequest, Unauthorized, ConnectionError, OSError, asyncio.TimeoutError) as e:
+            if cdn_session and isinstance(e, (Unauthorized, OSError, asyncio.TimeoutError)):
+                await sessions.discard(cdn_file.dc_id, cdn_session, cdn=True)
+            logger.warning(f"CDN DC{cdn_file.dc_id} failed for message {stream_file.message_id} ({e!r}); using the main DC")
+            cdn_registry.disable(stream_file.cache_key)
+            stream_monitor.record_recovery("cdn_fallback")
+            return None
+
+    async def _get_part(self, stream_file: StreamFile, offset: int, chunk_size: int, allow_file: bool):
+        """
+        One part, from the disk cache when present, otherwise from Telegram
+        (shared with concurrent readers, then cached). With `allow_file` a cache hit is returned as an open
+        CachedPart instead of being read into memory.
+        """
+        cacheable = chunk_size == PART_SIZE
+        if cacheable:
+            part = offset // PART_SIZE
+            cached = await chunk_cache.open_part(stream_file.cache_key, part)
+            if not cached and index_cache.contains(stream_file.cache_key, part):
+                # Container index (moov / Cues) pinned by util.media_index
+                cached = await index_cache.open_part(stream_file.cache_key, part)
+            if cached:
+                return cached if allow_file else await chunk_cache.read(cached)
+
+        async def fetch():
+            data = await self._fetch_split(stream_file, offset, chunk_size)
+            if cacheable and data:
+                chunk_cache.store_later(stream_file.cache_key, offset // PART_SIZE, data)
+            return data
+
+        # Viewers starting the same file together share one upstream GetFile per part.
+        return await part_coalescer.get((stream_file.cache_key, offset, chunk_size), fetch)
+
+    async def _fetch_split(self, stream_file: StreamFile, offset: int, chunk_size: int) -> bytes:
+        """
+        One part, fetched as the number of parallel sub-requests the tuner
+        picked for its DC; sub-requests past the end of the file come back empty.
+        The first failure (or a cancellation) stops the sibling sub-requests and
+        is raised as is, so callers still see FloodWait and friends unwrapped.
+        """
+        split = part_tuner.split(stream_file.dc_id) if chunk_size == PART_SIZE else 1
+        if split == 1:
+            return await self._fetch_part(stream_file, offset, chunk_size)
+        limit = chunk_size // split
+        tasks = [
+            asyncio.create_task(self._fetch_part(stream_file, offset + i * limit, limit))
+            for i in range(split)
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+        errors = [task.exception() for task in done if not task.cancelled() and task.exception()]
+        if errors:
+            raise errors[0]
+        return b"".join(task.result() for task in tasks)
+
+    async def read_bytes(self, stream_file: StreamFile, start: int, end: int) -> bytes:
+        """Bytes start..end (inclusive) collected in memory; for small internal reads."""
+        offset, first_part_cut, last_part_cut, part_count = self.plan_range(start, end)
+        data = bytearray()
+        async with aclosing(self.yield_file(stream_file, offset, first_part_cut, last_part_cut, part_count)) as body:
+            async for chunk in body:
+                data += chunk
+        if len(data) != end - start + 1:
+            raise IOError(f"Short read for bytes {start}-{end} of message {stream_file.message_id}")
+        return bytes(data)
+
+    @staticmethod
+    def _cut(chunk, start: int, stop: int | None = None):
+        if isinstance(chunk, CachedPart):
+            return chunk.slice(start, stop)
+        return memoryview(chunk)[start:stop]
+
+    async def yield_file(
+        self,
+        stream_file: StreamFile,
+        offset: int,
+        first_part_cut: int,
+        last_part_cut: int,
+        part_count: int,
+        chunk_size: int = PART_SIZE,
+        stats: StreamStats = None,
+        allow_file: bool = False
+    ):
+        """
+        Windowed read-ahead over GetFile.
+
+        Keeps as many parts in flight as the tuner picked for the file's DC
+        (never more than STREAM_MAX_BUFFER bytes), re-read as it learns, and
+        yields memoryviews over the part buffers so
+        the range cuts don't copy. When the consumer stops early, or the
+        request task is cancelled because the client disconnected, every
+        pending request is cancelled at once (releasing its media session
+        slot) and the abandoned read-ahead is recorded in `stats`.
+
+        Parts already in the disk cache are served from it; with `allow_file`
+        they are yielded as CachedPart slices for sendfile, and the consumer
+        owns (and must close) each one it receives; otherwise only the slice
+        the range needs is read from disk.
+        """
+        pending = deque()
+        next_offset = offset
+        scheduled = 0
+        current_part = 1
+        waiting = None
+
+        try:
+            while current_part <= part_count:
+                window = max(1, min(part_tuner.window(stream_file.dc_id), Config.STREAM_MAX_BUFFER // chunk_size, part_count))
+                while scheduled < part_count and len(pending) < window:
+                    pending.append(asyncio.create_task(
+                        # Cached parts always come back as files, so only the cut slice is read.
+                        self._get_part(stream_file, next_offset, chunk_size, allow_file=True)
+                    ))
+                    next_offset += chunk_size
+                    scheduled += 1
+
+                wait_started = time.monotonic()
+                waiting = pending.popleft()
+                try:
+                    chunk = await waiting
+                except Exception as e:
+                    logger.error(f"Error yielding file chunk: {e}", exc_info=True)
+                    break
+                waiting = None
+                if stats:
+                    stats.record_part(len(chunk), time.monotonic() - wait_started)
+                if not chunk:
+                    break
+
+                if part_count == 1:
+                    piece = self._cut(chunk, first_part_cut, last_part_cut)
+                elif current_part == 1:
+                    piece = self._cut(chunk, first_part_cut)
+                elif current_part == part_count:
+                    piece = self._cut(chunk, 0, last_part_cut)
+                else:
+                    piece = self._cut(chunk, 0)
+                if isinstance(piece, CachedPart) and not allow_file:
+                    piece = await chunk_cache.read(piece)
+                yield piece
+                current_part += 1
+        finally:
+            if waiting is not None and not waiting.done():
+                pending.appendleft(waiting)
+            abandoned_parts = abandoned_bytes = 0
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+                    abandoned_parts += 1
+                    abandoned_bytes += chunk_size
+                elif not task.cancelled() and task.exception() is None:
+                    result = task.result()
+                    if isinstance(result, CachedPart):
+                        result.close()
+                    else:
+                        abandoned_parts += 1
+                        abandoned_bytes += len(result)
+            if stats and abandoned_parts:
+                stats.record_cancelled(abandoned_parts, abandoned_bytes)
@@ -1,6 +1,8 @@
 # util/file_properties.py
 
+from datetime import timezone
 from pyrogram import Client
+from pyrogram.errors import BadRequest, Forbidden
 from typing import Any
 from pyrogram.types import Message
 from pyrogram.file_id import FileId
@@ -8,6 +10,118 @@ from pyrogram.file_id import FileId
 class FileIdError(Exception):
     pass
 
+
+def _epoch(value) -> int | None:
+    """Upload time as a unix timestamp; older records stored a datetime."""
+    if value is None or isinstance(value, int):
+        return value
+    return int(value.replace(tzinfo=value.tzinfo or timezone.utc).timestamp())
+
+
+class StreamFile:
+    """
+    Everything the stream engine needs to serve a stored file: the GetFile
+    location plus the headers metadata. Built either from the record saved
+    at ingest (no Telegram call) or from the channel message as a fallback.
+    """
+
+    def __init__(self, message_id: int, chat_id: int | None, dc_id: int, media_id: int, access_hash: int,
+                 file_reference: bytes, file_size: int, mime_type: str | None, file_name: str | None,
+                 file_unique_id: str | None, date=None, owner_id: int | None = None,
+                 batch_id: str | None = None, season: int | None = None,
+                 episode: int | None = None, episode_end: int | None = None,
+                 media_index: dict | None = None):
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.dc_id = dc_id
+        self.media_id = media_id
+        self.access_hash = access_hash
+        self.file_reference = file_reference
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.file_name = file_name
+        self.file_unique_id = file_unique_id
+        self.date = date
+        self.owner_id = owner_id
+        # Series placement saved by _finalize_collection (None for movies / ungrouped files)
+        self.batch_id = batch_id
+        self.season = season
+        self.episode = episode
+        self.episode_end = episode_end
+        # Container index byte ranges found by util.media_index (None = not looked at yet)
+        self.media_index = media_index
+
+    @classmethod
+    def from_message(cls, message: "Message", owner_id: int | None = None) -> "StreamFile | None":
+        media = get_media_from_message(message)
+        if not media:
+            return None
+        file_id = FileId.decode(media.file_id)
+        return cls(
+            message_id=message.id,
+            chat_id=message.chat.id if message.chat else None,
+            dc_id=file_id.dc_id,
+            media_id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            file_size=media.file_size,
+            mime_type=getattr(media, "mime_type", None),
+            file_name=getattr(media, "file_name", None),
+            file_unique_id=media.file_unique_id,
+            date=int(message.date.timestamp()) if message.date else None,
+            owner_id=owner_id
+        )
+
+    def use_location(self, other: "StreamFile"):
+        """Takes the GetFile location (not the metadata) of another copy of this file."""
+        self.dc_id = other.dc_id
+        self.media_id = other.media_id
+        self.access_hash = other.access_hash
+        self.file_reference = other.file_reference
+
+    @classmethod
+    def from_record(cls, record: dict) -> "StreamFile | None":
+        location = record.get("stream_location")
+        if not location:
+            return None
+        return cls(
+            message_id=record["stream_id"],
+            chat_id=location.get("chat_id"),
+            dc_id=location["dc_id"],
+            media_id=location["media_id"],
+            access_hash=location["access_hash"],
+            file_reference=bytes(location["file_reference"]),
+            file_size=location["file_size"],
+            mime_type=location.get("mime_type"),
+            file_name=record.get("file_name"),
+            file_unique_id=record.get("file_unique_id"),
+            date=_epoch(location.get("date")),
+            owner_id=record.get("owner_id"),
+            batch_id=record.get("batch_id"),
+            season=record.get("season"),
+            episode=record.get("episode"),
+            episode_end=record.get("episode_end"),
+            media_index=record.get("media_index")
+        )
+
+    @property
+    def cache_key(self) -> str:
+        """Stable per-file key for on-disk and in-memory part caches."""
+        return self.file_unique_id or f"m{self.media_id}"
+
+    def location_record(self) -> dict:
+        """The `stream_location` sub-document stored on the `files` record."""
+        return {
+            "chat_id": self.chat_id,
+            "dc_id": self.dc_id,
+            "media_id": self.media_id,
+            "access_hash": self.access_hash,
+            "file_reference": self.file_reference,
+            "file_size": self.file_size,
+            "mime_type": self.mime_type,
+            "date": self.date
+        }
+
 def get_media_from_message(message: "Message") -> Any:
     media_types = (
         "audio",
@@ -26,7 +140,7 @@ def get_media_from_message(message: "Message") -> Any:
     return None
 
 # --- FINAL SAFE VERSION (LOGIC UNCHANGED, ISSUE FIXED) ---
-async def get_message_with_properties(client: Client, message_id: int) -> Message | None:
+async def get_message_with_properties(client: Client, message_id: int, chat_id: int | None = None) -> Message | None:
     """
     Fetches the message from the storage channel and returns the full Message object.
 
@@ -34,9 +148,11 @@ async def get_message_with_properties(client: Client, message_id: int) -> Messag
     - No exception is raised for missing/deleted messages
     - Prevents /stream 500 errors
     - Prevents MXPlayer/VLC infinite retry loop
+    - Transient failures (FloodWait, timeouts, network) DO raise, so callers
+      don't cache a temporary error as a missing file
     """
 
-    stream_channel = client.stream_channel_id or client.owner_db_channel
+    stream_channel = chat_id or client.stream_channel_id or client.owner_db_channel
     if not stream_channel:
         return None
 
@@ -45,7 +161,8 @@ async def get_message_with_properties(client: Client, message_id: int) -> Messag
             chat_id=stream_channel,
             message_ids=message_id
         )
-    except Exception:
+    except (BadRequest, Forbidden, KeyError, ValueError):
+        # Invalid/inaccessible message or channel: the file is genuinely gone.
         return None
 
     # Pyrogram safety checks
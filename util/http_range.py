@@ -0,0 +1,194 @@
+# util/http_range.py
+
+import secrets
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+# More ranges than this in one request are ignored and the full body is sent
+# (RFC 7233 §6.1 allows it; it stops range-flooding).
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def make_etag(stream_file) -> str:
+    """Strong validator: the bytes behind a file_unique_id never change."""
+    return f'"{stream_file.cache_key}-{stream_file.file_size}"'
+
+
+def http_date(timestamp: int) -> str:
+    return format_datetime(datetime.fromtimestamp(timestamp, timezone.utc), usegmt=True)
+
+
+def _parse_http_date(value: str) -> int | None:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison against an If-None-Match list (RFC 7232 §2.3.2)."""
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_not_modified(headers, etag: str, last_modified: int | None = None) -> bool:
+    """
+    RFC 7232 §6 evaluation for GET/HEAD: If-None-Match wins when present,
+    otherwise If-Modified-Since is compared with `last_modified`.
+    """
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and last_modified <= since
+    return False
+
+
+def parse_range_header(header: str, size: int) -> list | None:
+    """
+    Parses a `Range: bytes=...` header against a representation of `size` bytes.
+
+    Returns a sorted list of merged inclusive (start, end) pairs, or None when
+    the header should be ignored (other unit, bad syntax, too many ranges).
+    Raises RangeNotSatisfiable when it is valid but no range overlaps the file.
+    Supports `a-b`, open-ended `a-` and suffix `-n` specs.
+    """
+    unit, sep, spec = header.partition("=")
+    if not sep or unit.strip().lower() != "bytes":
+        return None
+
+    ranges = []
+    for spec_part in spec.split(","):
+        spec_part = spec_part.strip()
+        if not spec_part:
+            continue
+        first, dash, last = spec_part.partition("-")
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+            return None
+
+        if first == "":
+            if last == "":
+                return None
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        end = int(last) if last else size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def if_range_matches(if_range: str | None, etag: str, last_modified: int | None = None) -> bool:
+    """
+    True when a Range request may be honoured: no If-Range, a strong ETag
+    match, or a date equal to our Last-Modified. Anything else means the
+    client gets the full body.
+    """
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith("W/"):
+        return False
+    return last_modified is not None and _parse_http_date(if_range) == last_modified
+
+
+class MultipartRanges:
+    """Framing for a multipart/byteranges body with an exact Content-Length."""
+
+    def __init__(self, ranges: list, size: int, content_type: str):
+        self.ranges = ranges
+        self.boundary = secrets.token_hex(16)
+        self.content_type = f"multipart/byteranges; boundary={self.boundary}"
+        self._part_type = content_type
+        self._size = size
+
+    def part_header(self, start: int, end: int) -> bytes:
+        return (
+            f"--{self.boundary}\r\n"
+            f"Content-Type: {self._part_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{self._size}\r\n\r\n"
+        ).encode()
+
+    @staticmethod
+    def part_footer() -> bytes:
+        return b"\r\n"
+
+    def closing(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode()
+
+    @property
+    def content_length(self) -> int:
+        total = len(self.closing())
+        for start, end in self.ranges:
+            total += len(self.part_header(start, end)) + (end - start + 1) + len(self.part_footer())
+        return total
+
+
+def pick_encoding(header: str | None, available) -> str:
+    """
+    The preferred content-coding from `available` that Accept-Encoding allows
+    (br over gzip), or "identity". Codings with q=0 are refused.
+    """
+    accepted = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding] = quality
+    for coding in ("br", "gzip"):
+        if coding in available and accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return "identity"
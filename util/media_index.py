@@ -0,0 +1,240 @@
+# util/media_index.py
+
+import struct
+import asyncio
+import logging
+from collections import OrderedDict
+from config import Config
+from database.db import set_media_index
+from util.chunk_cache import index_cache
+from util.client_pool import client_pool
+from util.custom_dl import ByteStreamer, PART_SIZE
+from util.file_properties import StreamFile
+
+logger = logging.getLogger(__name__)
+
+# Top-level MP4 boxes players need before (or for) seeking.
+MP4_INDEX_BOXES = {b"ftyp", b"moov", b"sidx", b"mfra"}
+MP4_MAX_BOXES = 64
+
+EBML_HEADER = 0x1A45DFA3
+MKV_SEGMENT = 0x18538067
+MKV_SEEK_HEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_CUES = 0x1C53BB6B
+MKV_CLUSTER = 0x1F43B675
+# The EBML header, SeekHead, Info and Tracks sit well inside this.
+MKV_HEAD_SCAN = 256 * 1024
+
+MAX_CONCURRENT = 2
+MAX_REMEMBERED = 4096
+
+
+def container_of(stream_file: StreamFile) -> str | None:
+    mime = (stream_file.mime_type or "").lower()
+    name = (stream_file.file_name or "").lower()
+    if mime in ("video/mp4", "video/quicktime", "video/x-m4v") or name.endswith((".mp4", ".m4v", ".mov")):
+        return "mp4"
+    if mime in ("video/x-matroska", "video/webm") or name.endswith((".mkv", ".webm")):
+        return "mkv"
+    return None
+
+
+async def locate_mp4(read, file_size: int) -> list:
+    """Byte ranges of the index boxes, found by walking top-level box headers."""
+    ranges = []
+    offset = 0
+    for _ in range(MP4_MAX_BOXES):
+        if offset + 8 > file_size:
+            break
+        header = await read(offset, min(offset + 16, file_size) - 1)
+        size, kind = struct.unpack(">I4s", header[:8])
+        header_len = 8
+        if size == 1 and len(header) >= 16:
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_len = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_len or (offset == 0 and kind != b"ftyp"):
+            break
+        if kind in MP4_INDEX_BOXES:
+            ranges.append((offset, min(offset + size, file_size) - 1))
+        offset += size
+    return ranges
+
+
+def _vint(buf: bytes, pos: int, keep_marker: bool):
+    """EBML variable-length integer at `pos`: (value, length, is_unknown_size)."""
+    first = buf[pos]
+    if first == 0:
+        raise ValueError("invalid EBML vint")
+    length = 9 - first.bit_length()
+    value = int.from_bytes(buf[pos:pos + length], "big")
+    if keep_marker:
+        return value, length, False
+    value &= (1 << (7 * length)) - 1
+    return value, length, value == (1 << (7 * length)) - 1
+
+
+def _element(buf: bytes, pos: int):
+    element_id, id_len, _ = _vint(buf, pos, keep_marker=True)
+    size, size_len, unknown = _vint(buf, pos + id_len, keep_marker=False)
+    return element_id, pos + id_len + size_len, None if unknown else size
+
+
+def _seek_positions(buf: bytes, start: int, end: int) -> dict:
+    """SeekHead children: {element id: position relative to the segment data}."""
+    positions = {}
+    pos = start
+    while pos < end:
+        element_id, data, size = _element(buf, pos)
+        if size is None:
+            break
+        if element_id == MKV_SEEK:
+            seek_id = seek_pos = None
+            child = data
+            while child < data + size:
+                child_id, child_data, child_size = _element(buf, child)
+                if child_size is None:
+                    break
+                value = buf[child_data:child_data + child_size]
+                if child_id == MKV_SEEK_ID:
+                    seek_id = int.from_bytes(value, "big")
+                elif child_id == MKV_SEEK_POSITION:
+                    seek_pos = int.from_bytes(value, "big")
+                child = child_data + child_size
+            if seek_id is not None and seek_pos is not None:
+                positions[seek_id] = seek_pos
+        pos = data + size
+    return positions
+
+
+async def locate_mkv(read, file_size: int) -> list:
+    """The metadata before the first Cluster, plus the Cues element found through the SeekHead."""
+    head = await read(0, min(MKV_HEAD_SCAN, file_size) - 1)
+    element_id, data, size = _element(head, 0)
+    if element_id != EBML_HEADER or size is None:
+        return []
+    element_id, segment_data, _ = _element(head, data + size)
+    if element_id != MKV_SEGMENT:
+        return []
+
+    ranges = []
+    seeks = {}
+    pos = segment_data
+    head_end = None
+    while pos + 12 <= len(head):
+        element_id, data, size = _element(head, pos)
+        if element_id == MKV_CLUSTER or size is None:
+            head_end = pos
+            break
+        if element_id == MKV_SEEK_HEAD and data + size <= len(head):
+            seeks.update(_seek_positions(head, data, data + size))
+        pos = data + size
+    ranges.append((0, (head_end or min(pos, len(head))) - 1))
+
+    if MKV_CUES in seeks:
+        cues_at = segment_data + seeks[MKV_CUES]
+        if cues_at + 12 <= file_size:
+            header = await read(cues_at, min(cues_at + 12, file_size) - 1)
+            element_id, data, size = _element(header, 0)
+            if element_id == MKV_CUES and size is not None:
+                ranges.append((cues_at, min(cues_at + (data + size), file_size) - 1))
+    return ranges
+
+
+class MediaIndexer:
+    """
+    Finds where a file's container index lives (MP4 moov/sidx/mfra, MKV
+    metadata + Cues) on first access, saves those byte ranges on the file
+    record and keeps the parts covering them in `index_cache`, which the
+    stream path reads before going upstream. Files whose record already has
+    the ranges are only re-pinned, never re-parsed.
+    """
+
+    def __init__(self):
+        self._seen = OrderedDict()
+        self._limit = asyncio.Semaphore(MAX_CONCURRENT)
+        self.located = 0
+        self.repinned = 0
+        self.not_found = 0
+        self.failures = 0
+        self.parts = 0
+        self.bytes = 0
+
+    def on_stream_start(self, stream_file: StreamFile):
+        if not index_cache.enabled or stream_file.cache_key in self._seen:
+            return
+        container = container_of(stream_file)
+        if container is None:
+            return
+        self._seen[stream_file.cache_key] = True
+        while len(self._seen) > MAX_REMEMBERED:
+            self._seen.popitem(last=False)
+        asyncio.create_task(self._index(stream_file, container))
+
+    async def _index(self, stream_file: StreamFile, container: str):
+        async with self._limit:
+            try:
+                async with client_pool.acquire() as client:
+                    streamer = ByteStreamer(client)
+                    stream_file = await streamer.located(stream_file)
+                    media_index = stream_file.media_index
+                    if media_index is None:
+                        media_index = await self._locate(streamer, stream_file, container)
+                    elif media_index['ranges']:
+                        self.repinned += 1
+                    if media_index['ranges']:
+                        await self._pin(streamer, stream_file, media_index['ranges'])
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Indexing {container} message {stream_file.message_id} failed: {e}")
+
+    async def _locate(self, streamer, stream_file: StreamFile, container: str) -> dict:
+        async def read(start, end):
+            return await streamer.read_bytes(stream_file, start, end)
+
+        locate = locate_mp4 if container == "mp4" else locate_mkv
+        ranges = await locate(read, stream_file.file_size)
+        media_index = {'format': container, 'ranges': [list(r) for r in ranges]}
+        await set_media_index(stream_file.message_id, media_index)
+        stream_file.media_index = media_index
+        if not ranges:
+            self.not_found += 1
+            return media_index
+        self.located += 1
+        logger.info(f"Message {stream_file.message_id}: {container} index at {ranges}")
+        return media_index
+
+    async def _pin(self, streamer, stream_file: StreamFile, ranges: list):
+        file_key = stream_file.cache_key
+        budget = Config.INDEX_MAX_BYTES
+        for start, end in ranges:
+            parts = range(start // PART_SIZE, end // PART_SIZE + 1)
+            if len(parts) * PART_SIZE > budget:
+                logger.info(f"Index range {start}-{end} of message {stream_file.message_id} is over INDEX_MAX_BYTES; not pinned")
+                continue
+            budget -= len(parts) * PART_SIZE
+            for part in parts:
+                if index_cache.contains(file_key, part):
+                    continue
+                data = await streamer._get_part(stream_file, part * PART_SIZE, PART_SIZE, allow_file=False)
+                await index_cache.store(file_key, part, data)
+                self.parts += 1
+                self.bytes += len(data)
+
+    def stats(self) -> dict:
+        return {
+            'located': self.located,
+            'repinned': self.repinned,
+            'not_found': self.not_found,
+            'failures': self.failures,
+            'parts': self.parts,
+            'bytes': self.bytes,
+            **{f"cache_{k}": v for k, v in index_cache.stats().items()},
+        }
+
+
+media_indexer = MediaIndexer()
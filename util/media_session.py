@@ -0,0 +1,232 @@
+# util/media_session.py
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from pyrogram import Client, raw
+from pyrogram.session import Session, Auth
+from pyrogram.session.internals import DataCenter
+from pyrogram.errors import AuthBytesInvalid
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+REAP_INTERVAL = 60
+
+
+class _PooledSession:
+    def __init__(self, session: Session, dc_id: int, cdn: bool = False):
+        self.session = session
+        self.dc_id = dc_id
+        self.cdn = cdn
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.created_at = time.monotonic()
+        self.last_used = time.monotonic()
+
+
+class MediaSessionManager:
+    """
+    Per-client pool of authorized media sessions, up to MEDIA_SESSIONS_PER_DC
+    for each DC so parallel GetFile calls don't queue on one connection.
+
+    Creating a session for a foreign DC needs an ExportAuthorization round
+    trip; a per-DC lock makes sure only one of those runs at a time and that
+    concurrent first requests wait for it instead of racing.
+
+    CDN DCs (from upload.FileCdnRedirect) get their own pools; they need no
+    authorization import. Pools are keyed by (dc_id, cdn).
+    """
+
+    def __init__(self, client: Client):
+        self.client = client
+        self.pools = {}
+        self._locks = {}
+        self.created = 0
+        self.reaped = 0
+
+    def _lock(self, key: tuple) -> asyncio.Lock:
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    async def _create(self, dc_id: int, cdn: bool = False) -> Session:
+        client = self.client
+        test_mode = await client.storage.test_mode()
+
+        if cdn:
+            if dc_id not in DataCenter.PROD:
+                raise ConnectionError(f"No address known for CDN DC{dc_id}")
+            session = Session(
+                client, dc_id, await Auth(client, dc_id, test_mode).create(),
+                test_mode, is_media=True, is_cdn=True
+            )
+            await session.start()
+            return session
+
+        if dc_id == await client.storage.dc_id():
+            # Home DC: the client's own auth key is already authorized there.
+            session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+            await session.start()
+            return session
+
+        session = Session(
+            client, dc_id, await Auth(client, dc_id, test_mode).create(),
+            test_mode, is_media=True
+        )
+        await session.start()
+        try:
+            for _ in range(3):
+                exported_auth = await client.invoke(
+                    raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+                )
+                try:
+                    await session.invoke(
+                        raw.functions.auth.ImportAuthorization(
+                            id=exported_auth.id,
+                            bytes=exported_auth.bytes
+                        )
+                    )
+                    break
+                except AuthBytesInvalid:
+                    continue
+            else:
+                raise AuthBytesInvalid()
+        except Exception:
+            await session.stop()
+            raise
+        return session
+
+    def _pick(self, key: tuple) -> _PooledSession | None:
+        pool = self.pools.get(key)
+        if not pool:
+            return None
+        return min(pool, key=lambda s: s.in_flight)
+
+    async def _acquire(self, dc_id: int, cdn: bool = False) -> _PooledSession:
+        key = (dc_id, cdn)
+        label = _label(key)
+        best = self._pick(key)
+        if best and (best.in_flight == 0 or len(self.pools[key]) >= Config.MEDIA_SESSIONS_PER_DC):
+            return best
+
+        async with self._lock(key):
+            # Someone may have grown the pool while we waited for the lock.
+            best = self._pick(key)
+            if best and (best.in_flight == 0 or len(self.pools[key]) >= Config.MEDIA_SESSIONS_PER_DC):
+                return best
+            try:
+                pooled = _PooledSession(await self._create(dc_id, cdn), dc_id, cdn)
+            except Exception as e:
+                if best:
+                    logger.warning(f"Could not grow {label} media pool, reusing a busy session: {e}")
+                    return best
+                raise
+            self.pools.setdefault(key, []).append(pooled)
+            self.created += 1
+            logger.info(f"Media session #{len(self.pools[key])} for {label} ready.")
+            return pooled
+
+    @asynccontextmanager
+    async def session(self, dc_id: int, cdn: bool = False):
+        """Borrows the least busy session for `dc_id`, creating one if the pool has room."""
+        pooled = await self._acquire(dc_id, cdn)
+        pooled.in_flight += 1
+        pooled.requests += 1
+        try:
+            yield pooled.session
+        except Exception:
+            pooled.failures += 1
+            raise
+        finally:
+            pooled.in_flight -= 1
+            pooled.last_used = time.monotonic()
+
+    async def get(self, dc_id: int, cdn: bool = False) -> Session:
+        """A session for `dc_id` without tracking the call (for one-off invokes)."""
+        return (await self._acquire(dc_id, cdn)).session
+
+    async def discard(self, dc_id: int, session: Session, cdn: bool = False):
+        """Drops a session that is misbehaving; the next borrower gets a fresh one."""
+        pool = self.pools.get((dc_id, cdn), [])
+        for pooled in pool:
+            if pooled.session is session:
+                pool.remove(pooled)
+                await self._close(pooled)
+                logger.warning(f"Replaced a failing {_label((dc_id, cdn))} media session ({len(pool)} left).")
+                return
+
+    async def warm_up(self):
+        """Authorizes one media session per DC up front so first viewers don't pay for it."""
+        dc_ids = range(1, 4) if await self.client.storage.test_mode() else range(1, 6)
+        results = await asyncio.gather(*(self._acquire(dc_id) for dc_id in dc_ids), return_exceptions=True)
+        failed = [dc_id for dc_id, r in zip(dc_ids, results) if isinstance(r, Exception)]
+        if failed:
+            logger.warning(f"Media session warm-up failed for DCs {failed}; they will be created on demand.")
+        else:
+            logger.info(f"Media sessions warmed up for DCs {list(dc_ids)}.")
+
+    async def _close(self, pooled: _PooledSession):
+        try:
+            await pooled.session.stop()
+        except Exception as e:
+            logger.debug(f"Error closing DC{pooled.dc_id} media session: {e}")
+
+    async def reap_idle(self):
+        """Closes sessions idle for MEDIA_SESSION_IDLE_TIMEOUT, keeping one per DC warm."""
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            try:
+                await self._reap_pass()
+            except Exception as e:
+                logger.error(f"Idle media session reaping failed (will retry): {e!r}")
+
+    async def _reap_pass(self):
+        now = time.monotonic()
+        # Snapshots: _acquire/discard may change the pools while a close is awaited.
+        for key, pool in list(self.pools.items()):
+            idle = [
+                s for s in pool
+                if s.in_flight == 0 and now - s.last_used > Config.MEDIA_SESSION_IDLE_TIMEOUT
+            ]
+            for pooled in idle[:max(0, len(pool) - 1)]:
+                if pooled not in pool:
+                    continue
+                pool.remove(pooled)
+                self.reaped += 1
+                await self._close(pooled)
+                logger.info(f"Closed idle {_label(key)} media session ({len(pool)} left).")
+
+    async def close_all(self):
+        for pool in list(self.pools.values()):
+            for pooled in list(pool):
+                await self._close(pooled)
+        self.pools.clear()
+
+    def health(self) -> dict:
+        now = time.monotonic()
+        return {
+            _label(key): {
+                'sessions': len(pool),
+                'in_flight': sum(s.in_flight for s in pool),
+                'requests': sum(s.requests for s in pool),
+                'failures': sum(s.failures for s in pool),
+                'idle': round(min((now - s.last_used for s in pool), default=0)),
+            }
+            for key, pool in sorted(self.pools.items())
+        }
+
+
+def _label(key: tuple) -> str:
+    dc_id, cdn = key
+    return f"CDN{dc_id}" if cdn else f"DC{dc_id}"
+
+
+def get_session_manager(client: Client) -> MediaSessionManager:
+    manager = getattr(client, "media_session_manager", None)
+    if manager is None:
+        manager = MediaSessionManager(client)
+        client.media_session_manager = manager
+    return manager
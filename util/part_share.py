@@ -0,0 +1,101 @@
+# util/part_share.py
+
+import time
+import asyncio
+from collections import OrderedDict
+from config import Config
+
+
+class PartCoalescer:
+    """
+    Single-flight for upstream part fetches.
+
+    Concurrent readers of the same (file, offset, limit) await one shared
+    fetch. The fetch is reference counted: it is cancelled only when every
+    reader has gone. Finished parts are kept for a short retention window so
+    viewers a few seconds behind reuse the same buffer.
+    """
+
+    def __init__(self, retention: float, max_bytes: int):
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self._inflight = {}
+        self._recent = OrderedDict()
+        self._recent_bytes = 0
+
+        self.fetched = 0
+        self.shared = 0
+        self.reused = 0
+        self.cancelled = 0
+        self.bytes_deduplicated = 0
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._recent:
+            key, (data, expires) = next(iter(self._recent.items()))
+            if expires > now and self._recent_bytes <= self.max_bytes:
+                break
+            del self._recent[key]
+            self._recent_bytes -= len(data)
+
+    def _remember(self, key, data: bytes):
+        if not data or self.retention <= 0 or len(data) > self.max_bytes:
+            return
+        old = self._recent.pop(key, None)
+        if old:
+            self._recent_bytes -= len(old[0])
+        self._recent[key] = (data, time.monotonic() + self.retention)
+        self._recent_bytes += len(data)
+        self._expire()
+
+    def _on_done(self, key, task):
+        entry = self._inflight.get(key)
+        if entry and entry[0] is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._remember(key, task.result())
+
+    async def get(self, key, fetch):
+        self._expire()
+        recent = self._recent.get(key)
+        if recent:
+            self.reused += 1
+            self.bytes_deduplicated += len(recent[0])
+            return recent[0]
+
+        entry = self._inflight.get(key)
+        joined = entry is not None
+        if joined:
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(fetch())
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda t, k=key: self._on_done(k, t))
+            self.fetched += 1
+
+        entry[1] += 1
+        try:
+            data = await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+                self.cancelled += 1
+        if joined:
+            self.bytes_deduplicated += len(data)
+        return data
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._inflight),
+            'retained': len(self._recent),
+            'retained_bytes': self._recent_bytes,
+            'fetched': self.fetched,
+            'shared': self.shared,
+            'reused': self.reused,
+            'cancelled': self.cancelled,
+            'bytes_deduplicated': self.bytes_deduplicated,
+        }
+
+
+part_coalescer = PartCoalescer(Config.PART_SHARE_RETENTION, Config.PART_SHARE_MAX_BYTES)
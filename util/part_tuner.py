@@ -0,0 +1,135 @@
+# util/part_tuner.py
+
+import math
+from collections import Counter
+from config import Config
+
+# Sub-requests per 1 MB part: limits of 1 MB, 512 KB, 256 KB. Each divides
+# 1 MB and sub-request offsets stay multiples of their limit, so they keep
+# Telegram's alignment rules (offset divisible by 4 KB, limit divides 1 MB).
+SPLITS = (1, 2, 4)
+# Weight of a new latency sample in the per-limit moving averages.
+ALPHA = 0.3
+# Samples needed at each of two limits before the model is trusted.
+MIN_SAMPLES = 3
+# Once tuned, every Nth part re-measures a neighbouring split to follow changes.
+EXPLORE_EVERY = 32
+
+
+class DcTuning:
+    def __init__(self):
+        self.latency = {}
+        self.samples = Counter()
+        self.rtt = None
+        self.transfer = None
+        self.split = 1
+        self.window = None
+        self.parts = 0
+
+    def fitted(self) -> bool:
+        return sum(1 for n in self.samples.values() if n >= MIN_SAMPLES) >= 2
+
+
+class PartTuner:
+    """
+    Learns per DC how long one GetFile takes, modelled as a fixed round trip
+    plus a transfer time proportional to its limit (fitted from the average
+    latency at two limits), and picks from that:
+
+    - split: how many sub-requests each 1 MB part is fetched as, in
+      parallel. More is worth it while a sub-request still spends at least
+      as long transferring as it waits on the round trip.
+    - window: parts kept in flight, enough to sustain STREAM_TUNER_TARGET_RATE
+      over one part's latency (the bandwidth-delay product), capped by
+      STREAM_MAX_BUFFER.
+
+    Until a DC is fitted its parts alternate between whole and halved
+    requests, which settles within the first few parts of the first stream;
+    the result is kept for every later request to that DC. Logical parts
+    stay 1 MB, so caches and shared fetches are unaffected.
+    """
+
+    def __init__(self, part_size: int, max_split: int, max_window: int, target_rate: int):
+        self.part_size = part_size
+        self.splits = [s for s in SPLITS if s <= max(max_split, 1)]
+        self.max_window = max(max_window, 1)
+        self.target_rate = target_rate
+        self.enabled = Config.STREAM_TUNER_ENABLED
+        self._dcs = {}
+
+    def _dc(self, dc_id: int) -> DcTuning:
+        tuning = self._dcs.get(dc_id)
+        if tuning is None:
+            tuning = self._dcs[dc_id] = DcTuning()
+        return tuning
+
+    def split(self, dc_id: int) -> int:
+        """Sub-requests to use for the next part fetched from `dc_id`."""
+        if not self.enabled or len(self.splits) < 2:
+            return 1
+        tuning = self._dc(dc_id)
+        tuning.parts += 1
+        if not tuning.fitted():
+            # Exploration: whole and halved parts in turn.
+            return 1 if tuning.samples[self.part_size] <= tuning.samples[self.part_size // 2] else 2
+        if tuning.parts % EXPLORE_EVERY == 0:
+            index = self.splits.index(tuning.split)
+            return self.splits[index - 1] if index else self.splits[1]
+        return tuning.split
+
+    def window(self, dc_id: int) -> int:
+        """Parts to keep in flight for a stream from `dc_id`."""
+        tuning = self._dcs.get(dc_id)
+        if not self.enabled or tuning is None or tuning.window is None:
+            return min(Config.STREAM_PREFETCH_PARTS, self.max_window)
+        return tuning.window
+
+    def record(self, dc_id: int, limit: int, elapsed: float):
+        """Latency of one full GetFile of `limit` bytes (no retries or waits included)."""
+        if not self.enabled:
+            return
+        tuning = self._dc(dc_id)
+        previous = tuning.latency.get(limit)
+        tuning.latency[limit] = elapsed if previous is None else previous + ALPHA * (elapsed - previous)
+        tuning.samples[limit] += 1
+        if tuning.fitted():
+            self._refit(tuning)
+
+    def _refit(self, tuning: DcTuning):
+        measured = sorted(
+            (limit, latency) for limit, latency in tuning.latency.items()
+            if tuning.samples[limit] >= MIN_SAMPLES
+        )
+        (small, small_latency), (large, large_latency) = measured[0], measured[-1]
+        per_byte = max((large_latency - small_latency) / (large - small), 1e-10)
+        tuning.rtt = max(large_latency - large * per_byte, 0.0)
+        tuning.transfer = self.part_size * per_byte
+
+        split = self.splits[0]
+        for candidate in self.splits:
+            if tuning.transfer / candidate >= tuning.rtt:
+                split = candidate
+        tuning.split = split
+        part_latency = tuning.rtt + tuning.transfer / split
+        wanted = math.ceil(self.target_rate * part_latency / self.part_size)
+        tuning.window = max(1, min(wanted, self.max_window))
+
+    def stats(self) -> dict:
+        return {
+            dc_id: {
+                'fitted': tuning.fitted(),
+                'limit': self.part_size // tuning.split,
+                'window': self.window(dc_id),
+                'rtt_ms': round(tuning.rtt * 1000) if tuning.rtt is not None else None,
+                'rate': round(self.part_size / tuning.transfer) if tuning.transfer else None,
+            }
+            for dc_id, tuning in sorted(self._dcs.items())
+        }
+
+
+part_tuner = PartTuner(
+    1024 * 1024,
+    Config.STREAM_TUNER_MAX_SPLIT,
+    Config.STREAM_MAX_BUFFER // (1024 * 1024),
+    Config.STREAM_TUNER_TARGET_RATE
+)
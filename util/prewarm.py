@@ -0,0 +1,195 @@
+# util/prewarm.py
+
+import time
+import asyncio
+import logging
+from config import Config
+from database.db import get_next_episode
+from util.bandwidth import TokenBucket
+from util.chunk_cache import chunk_cache
+from util.client_pool import client_pool
+from util.custom_dl import ByteStreamer, PART_SIZE
+from util.file_properties import StreamFile
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 256
+# A prefetched episode that isn't opened within this many seconds counts as a miss.
+PREFETCH_HIT_WINDOW = 6 * 3600
+
+
+def warm_parts(file_size: int, head_bytes: int, tail_bytes: int) -> list:
+    """Part indexes covering the first `head_bytes` and last `tail_bytes` of a file."""
+    if file_size <= 0:
+        return []
+    last_part = (file_size - 1) // PART_SIZE
+    head = range(0, min(-(-head_bytes // PART_SIZE), last_part + 1))
+    tail_start = max((file_size - tail_bytes) // PART_SIZE, 0) if tail_bytes else last_part + 1
+    return sorted(set(head) | set(range(tail_start, last_part + 1)))
+
+
+class Prewarmer:
+    """
+    Background worker that fetches the head (and optionally tail) of files
+    into the chunk cache, so the first viewer never waits on a cold upstream
+    fetch (the tail usually holds the MP4 moov atom).
+
+    Jobs go through a bounded queue and one worker, so a big ingest batch
+    trickles into the cache instead of competing with live streams; `rate`
+    (bytes/s, 0 = unlimited) caps the upstream bandwidth it may use.
+    """
+
+    def __init__(self, head_bytes: int, tail_bytes: int, pinned: bool, rate: int = 0):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.pinned = pinned
+        self._budget = TokenBucket(rate)
+        self._queue = asyncio.Queue(QUEUE_SIZE)
+        self._worker = None
+        self.scheduled = 0
+        self.dropped = 0
+        self.files = 0
+        self.parts = 0
+        self.bytes = 0
+        self.failures = 0
+
+    def schedule(self, stream_file: StreamFile) -> bool:
+        if not chunk_cache.enabled or not stream_file:
+            return False
+        try:
+            self._queue.put_nowait(stream_file)
+            self.scheduled += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self):
+        while not self._queue.empty():
+            stream_file = self._queue.get_nowait()
+            try:
+                await self.warm(stream_file)
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Pre-warm failed for message {stream_file.message_id}: {e}")
+
+    async def warm(self, stream_file: StreamFile):
+        file_key = stream_file.cache_key
+        parts = warm_parts(stream_file.file_size, self.head_bytes, self.tail_bytes)
+        async with client_pool.acquire() as client:
+            streamer = ByteStreamer(client)
+            stream_file = await streamer.located(stream_file)
+            for part in parts:
+                if self.pinned and chunk_cache.pin(file_key, part):
+                    continue
+                if not self.pinned and chunk_cache.contains(file_key, part):
+                    continue
+                delay = self._budget.reserve(PART_SIZE)
+                if delay:
+                    await asyncio.sleep(delay)
+                data = await streamer._fetch_part(stream_file, part * PART_SIZE, PART_SIZE)
+                if not data:
+                    break
+                await chunk_cache.store(file_key, part, data, pinned=self.pinned)
+                self.parts += 1
+                self.bytes += len(data)
+        self.files += 1
+        logger.info(f"Pre-warmed {len(parts)} parts of message {stream_file.message_id} ({file_key})")
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queue.qsize(),
+            'scheduled': self.scheduled,
+            'dropped': self.dropped,
+            'files': self.files,
+            'parts': self.parts,
+            'bytes': self.bytes,
+            'failures': self.failures,
+        }
+
+
+class EpisodePrefetcher:
+    """
+    Warms the head of episode N+1 once a viewer of episode N has played
+    through PREFETCH_PROGRESS of the file: one response that started below
+    that point has streamed contiguously past it. Seeks past the mark and
+    players reading a trailing moov on open don't count. Uses the batch/season/episode order saved
+    by _finalize_collection. Runs under its own bandwidth budget.
+
+    Hit rate: a prefetched episode that gets streamed within
+    PREFETCH_HIT_WINDOW is a hit, one that doesn't is a miss.
+    """
+
+    def __init__(self):
+        self.warmer = Prewarmer(Config.PREFETCH_HEAD_BYTES, 0, pinned=False, rate=Config.PREFETCH_RATE_LIMIT)
+        self._triggered = {}
+        self._prefetched = {}
+        self.triggers = 0
+        self.no_next = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _expire(self, now: float):
+        for key, at in list(self._prefetched.items()):
+            if now - at > PREFETCH_HIT_WINDOW:
+                del self._prefetched[key]
+                self.misses += 1
+        for key, at in list(self._triggered.items()):
+            if now - at > PREFETCH_HIT_WINDOW:
+                del self._triggered[key]
+
+    def on_stream_start(self, stream_file: StreamFile):
+        """Counts a hit when a viewer opens an episode we prefetched."""
+        if self._prefetched.pop(stream_file.cache_key, None) is not None:
+            self.hits += 1
+
+    def on_progress(self, stream_file: StreamFile, start: int, position: int):
+        """`position` is how far a response that began at byte `start` has streamed."""
+        if not Config.PREFETCH_ENABLED or not stream_file.batch_id or stream_file.episode is None:
+            return
+        threshold = stream_file.file_size * Config.PREFETCH_PROGRESS
+        if not stream_file.file_size or start >= threshold or position < threshold:
+            return
+        if stream_file.cache_key in self._triggered:
+            return
+        now = time.monotonic()
+        self._expire(now)
+        self._triggered[stream_file.cache_key] = now
+        self.triggers += 1
+        asyncio.create_task(self._prefetch_next(stream_file))
+
+    async def _prefetch_next(self, stream_file: StreamFile):
+        try:
+            record = await get_next_episode(
+                stream_file.batch_id, stream_file.season, stream_file.episode_end or stream_file.episode
+            )
+        except Exception as e:
+            logger.warning(f"Next-episode lookup failed for message {stream_file.message_id}: {e}")
+            return
+        next_file = StreamFile.from_record(record) if record else None
+        if not next_file:
+            self.no_next += 1
+            return
+        if next_file.cache_key in self._prefetched or chunk_cache.contains(next_file.cache_key, 0):
+            return
+        if self.warmer.schedule(next_file):
+            self._prefetched[next_file.cache_key] = time.monotonic()
+            logger.info(f"Prefetching next episode (message {next_file.message_id}) after message {stream_file.message_id}")
+
+    def stats(self) -> dict:
+        decided = self.hits + self.misses
+        return {
+            **self.warmer.stats(),
+            'triggers': self.triggers,
+            'no_next': self.no_next,
+            'pending': len(self._prefetched),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / decided, 3) if decided else 0.0,
+        }
+
+
+prewarmer = Prewarmer(Config.PREWARM_HEAD_BYTES, Config.PREWARM_TAIL_BYTES, pinned=True)
+episode_prefetcher = EpisodePrefetcher()
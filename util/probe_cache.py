@@ -0,0 +1,52 @@
+# util/probe_cache.py
+
+from config import Config
+from util.cache import AsyncLRUCache
+
+# (file cache_key, "head" | "tail") -> the first / last PROBE_WINDOW bytes of the file.
+probe_cache = AsyncLRUCache(Config.PROBE_CACHE_FILES * 2, Config.PROBE_CACHE_TTL, 0)
+
+
+def probe_window(file_size: int, start: int, end: int):
+    """
+    ("head", 0) or ("tail", window_start) when start..end is a small probe
+    that fits in one of the file's edge windows, otherwise None.
+    """
+    window = Config.PROBE_WINDOW
+    if end - start + 1 > Config.PROBE_MAX_BYTES:
+        return None
+    if end < window:
+        return "head", 0
+    tail_start = max(file_size - window, 0)
+    if start >= tail_start:
+        return "tail", tail_start
+    return None
+
+
+def cached_probe(stream_file, start: int, end: int) -> bytes | None:
+    """Bytes start..end when their probe window is already cached; never reads upstream."""
+    placement = probe_window(stream_file.file_size, start, end)
+    if placement is None:
+        return None
+    which, window_start = placement
+    window = probe_cache.peek((stream_file.cache_key, which))
+    return window[start - window_start:end - window_start + 1] if window is not None else None
+
+
+async def read_probe(streamer, stream_file, start: int, end: int) -> bytes | None:
+    """
+    Bytes start..end served from the file's cached head/tail window; the
+    window is filled once (one upstream read) and shared by every probe
+    that follows. None when the range isn't a probe.
+    """
+    file_size = stream_file.file_size
+    placement = probe_window(file_size, start, end)
+    if placement is None:
+        return None
+    which, window_start = placement
+    window_end = min(window_start + Config.PROBE_WINDOW, file_size) - 1
+    window = await probe_cache.get_or_load(
+        (stream_file.cache_key, which),
+        lambda: streamer.read_bytes(stream_file, window_start, window_end)
+    )
+    return window[start - window_start:end - window_start + 1]
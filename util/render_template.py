@@ -1,33 +1,94 @@
+import os
+import gzip
+import zlib
 import jinja2
-import aiofiles
 import logging
 from pyrogram import Client
+from config import Config
+from util.cache import AsyncLRUCache
 from util.custom_dl import ByteStreamer
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEMPLATE_DIR = 'template'
+PLAYER_TEMPLATE = f'{TEMPLATE_DIR}/player.html'
+
+# Templates are compiled once and shared; auto_reload recompiles one only
+# when its file's mtime changes, so edits still show up without a restart.
+# Values inside <script> go through |tojson; everything else is HTML-escaped.
+template_env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE_DIR), auto_reload=True, autoescape=True)
+
+# (message_id, signed query, template version) -> {"identity" | "gzip" | "br": body bytes}
+player_page_cache = AsyncLRUCache(Config.WATCH_PAGE_CACHE_SIZE, Config.WATCH_PAGE_CACHE_TTL, 0)
+
+
+def _template_version() -> int:
+    try:
+        return int(os.stat(PLAYER_TEMPLATE).st_mtime)
+    except OSError:
+        return 0
+
+
+def player_page_etag(bot: Client, message_id: int, query: str = "") -> str:
+    """
+    Validator for a /watch page: changes only when the template file, the
+    public URL or the page's signed query changes, so browsers and CDNs can
+    revalidate without a render.
+    """
+    site = zlib.crc32(f"{bot.app_url}?{query}".encode())
+    return f'W/"watch-{message_id}-{_template_version()}-{site:08x}"'
+
+
+def compress_page(html: str) -> dict:
+    """The page body in every content-coding we can serve, compressed once."""
+    body = html.encode()
+    encoded = {"identity": body, "gzip": gzip.compress(body, 9)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=11)
+    return encoded
+
+
 # --- LEGENDARY MODIFICATION: Create a dedicated renderer for the new player page ---
-async def render_player_page(bot: Client, message_id: int):
+async def render_player_page(bot: Client, message_id: int, query: str = ""):
     """
     Renders the new player.html template for the watch page.
+    `query` is the page's verified exp/sig (see signed_query), carried over to the stream URL.
     """
-    
+
     # --- DECREED MODIFICATION: Use bot.app_url ---
     # bot.app_url is set in bot.py's __init__ and is already stripped of trailing slashes
     file_url = f"{bot.app_url}/stream/{message_id}"
-    
+    if query:
+        file_url += f"?{query}"
+
     try:
-        async with aiofiles.open('template/player.html', 'r') as f:
-            template_content = await f.read()
-        template = jinja2.Template(template_content)
+        template = template_env.get_template('player.html')
 
         return template.render(
             file_url=file_url
         )
-    except FileNotFoundError:
+    except jinja2.TemplateNotFound:
         logging.error("FATAL: player.html template not found in /template directory!")
-        return "<html><body><h1>500 Internal Server Error</h1><p>Template file not found.</p></body></html>"
+        return None
     except Exception as e:
         logging.error(f"Error rendering player template: {e}", exc_info=True)
-        return "<html><body><h1>500 Internal Server Error</h1><p>Could not render template.</p></body></html>"
+        return None
+
+
+async def player_page(bot: Client, message_id: int, query: str = "") -> dict | None:
+    """
+    The compressed /watch page for a message, rendered once per message id,
+    signed query and template version and then served from memory.
+    None when the template can't be rendered (never cached).
+    """
+    async def load():
+        html = await render_player_page(bot, message_id, query)
+        return compress_page(html) if html is not None else None
+
+    return await player_page_cache.get_or_load((message_id, query, _template_version()), load)
 
 
 # The old render_page function is kept in case it's used elsewhere, but the new one is primary.
@@ -49,11 +110,9 @@ async def render_page(bot: Client, message_id: int):
     # --- DECREED MODIFICATION: Use bot.app_url ---
     stream_url = f"{bot.app_url}/stream/{message_id}"
     download_url = f"{bot.app_url}/download/{message_id}"
-    
+
     try:
-        async with aiofiles.open('template/watch_page.html', 'r') as f:
-            template_content = await f.read()
-        template = jinja2.Template(template_content)
+        template = template_env.get_template('watch_page.html')
 
         return template.render(
             heading=f"Watch {file_name}",
@@ -61,7 +120,7 @@ async def render_page(bot: Client, message_id: int):
             stream_url=stream_url,
             download_url=download_url
         )
-    except FileNotFoundError:
+    except jinja2.TemplateNotFound:
         logging.error("FATAL: watch_page.html template not found in /template directory!")
         return "<html><body><h1>500 Internal Server Error</h1><p>Template file not found.</p></body></html>"
     except Exception as e:
@@ -0,0 +1,173 @@
+# util/signing.py
+
+import hmac
+import logging
+import time
+import base64
+import hashlib
+from urllib.parse import urlencode
+from collections import Counter
+from datetime import datetime, timezone
+from aiohttp import web
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SIGNED_PREFIXES = ("/watch/", "/stream/", "/download/", "/zip/")
+# Routes added after signing existed; they never had unsigned links.
+SIGNED_ONLY_PREFIXES = ("/zip/",)
+
+
+class HmacSigner:
+    """
+    exp + HMAC-SHA256(key, "<message_id>:<exp>") truncated to 128 bits.
+    The subject is a message id, or a batch id for /zip links.
+
+    The signature covers the message id, not the route, so a signed /watch
+    link carries over to its /stream and /download URLs. The key id prefix
+    lets several keys verify side by side while a secret is rotated.
+    """
+
+    def __init__(self, secret: bytes):
+        self._secret = secret
+        self.key_id = hashlib.sha256(secret).hexdigest()[:4]
+
+    def _digest(self, message_id: int | str, expires: int) -> str:
+        mac = hmac.new(self._secret, f"{message_id}:{expires}".encode(), hashlib.sha256).digest()[:16]
+        return base64.urlsafe_b64encode(mac).rstrip(b"=").decode()
+
+    def sign(self, message_id: int | str, expires: int) -> dict:
+        return {"exp": str(expires), "sig": f"{self.key_id}.{self._digest(message_id, expires)}"}
+
+    def verify(self, message_id: int | str, query) -> str | None:
+        """None when valid, otherwise the rejection reason."""
+        key_id, _, digest = query.get("sig", "").partition(".")
+        if key_id != self.key_id:
+            return "unknown_key"
+        try:
+            expires = int(query.get("exp", ""))
+        except ValueError:
+            return "bad_signature"
+        if not hmac.compare_digest(digest, self._digest(message_id, expires)):
+            return "bad_signature"
+        if expires < time.time():
+            return "expired"
+        return None
+
+
+class LegacySigner:
+    """Accepts unsigned ids while old links are being migrated (until `until`, if set)."""
+
+    key_id = None
+
+    def __init__(self, until: int | None):
+        self.until = until
+
+    def verify(self, message_id: int | str, query) -> str | None:
+        if "sig" in query:
+            return "unknown_key"
+        if self.until is not None and time.time() > self.until:
+            return "unsigned"
+        return None
+
+
+class LinkSigner:
+    """
+    Signs new links with the first signer and verifies with any of them.
+
+    Expiries are rounded up to LINK_EXPIRY_BUCKET so every link handed out
+    for a file within one bucket is the same URL (and caches as one).
+    """
+
+    def __init__(self, signers: list, ttl: int, bucket: int):
+        self.signers = signers
+        self.ttl = ttl
+        self.bucket = max(bucket, 1)
+        self.accepted = Counter()
+        self.rejected = Counter()
+
+    def expiry(self) -> int:
+        deadline = int(time.time()) + self.ttl
+        return -(-deadline // self.bucket) * self.bucket
+
+    def query(self, message_id: int | str) -> str:
+        return urlencode(self.signers[0].sign(message_id, self.expiry()))
+
+    def url(self, base_url: str, route: str, message_id: int | str) -> str:
+        return f"{base_url.rstrip('/')}/{route}/{message_id}?{self.query(message_id)}"
+
+    def verify(self, message_id: int | str, query, allow_legacy: bool = True) -> str | None:
+        reason = "unsigned" if "sig" not in query else "unknown_key"
+        for signer in self.signers:
+            if signer.key_id is None and not allow_legacy:
+                continue
+            result = signer.verify(message_id, query)
+            if result is None:
+                self.accepted["legacy" if signer.key_id is None else "signed"] += 1
+                return None
+            if result != "unknown_key":
+                reason = result
+        self.rejected[reason] += 1
+        return reason
+
+    def stats(self) -> dict:
+        return {'accepted': dict(self.accepted), 'rejected': dict(self.rejected)}
+
+
+def _secrets() -> list:
+    configured = [s for s in Config.LINK_SECRETS if s]
+    if configured:
+        return [s.encode() for s in configured]
+    # Without a configured secret, derive a stable one from the bot token.
+    return [hashlib.sha256(f"stream-links:{Config.BOT_TOKEN}".encode()).digest()]
+
+
+def _legacy_until() -> int | None:
+    if not Config.LINK_LEGACY_UNTIL:
+        return None
+    return int(datetime.fromisoformat(Config.LINK_LEGACY_UNTIL).replace(tzinfo=timezone.utc).timestamp())
+
+
+def build_signer() -> LinkSigner:
+    signers = [HmacSigner(secret) for secret in _secrets()]
+    if Config.LINK_ALLOW_LEGACY:
+        until = _legacy_until()
+        if until is None:
+            logger.error(
+                "LINK_ALLOW_LEGACY is on with no LINK_LEGACY_UNTIL: unsigned sequential /stream and "
+                "/download ids stay valid forever and can be enumerated. Set LINK_LEGACY_UNTIL "
+                "(e.g. 2 weeks out) or LINK_ALLOW_LEGACY=False."
+            )
+        signers.append(LegacySigner(until))
+    return LinkSigner(signers, Config.LINK_TTL, Config.LINK_EXPIRY_BUCKET)
+
+
+link_signer = build_signer()
+
+
+def signed_query(query) -> str:
+    """
+    The link's own exp/sig rebuilt from a request query, dropping anything
+    else the client appended; safe to embed in a page or cache key.
+    """
+    return urlencode({k: query[k] for k in ("exp", "sig") if k in query})
+
+
+@web.middleware
+async def signed_link_middleware(request, handler):
+    """Rejects unsigned, forged or expired media links before any other work."""
+    path = request.path
+    if path.startswith(SIGNED_PREFIXES):
+        subject = path.rstrip("/").rsplit("/", 1)[1]
+        signed_only = path.startswith(SIGNED_ONLY_PREFIXES)
+        if not signed_only:
+            try:
+                subject = int(subject)
+            except ValueError:
+                return await handler(request)
+        reason = link_signer.verify(subject, request.query, allow_legacy=not signed_only)
+        if reason == "expired":
+            return web.Response(status=410, text="This link has expired. Request the file again from the bot.")
+        if reason:
+            return web.Response(status=403, text="Invalid link.")
+    return await handler(request)
@@ -0,0 +1,72 @@
+# util/stream_health.py
+
+from util.stream_stats import stream_monitor
+from util.custom_dl import stream_file_cache, message_cache
+from util.probe_cache import probe_cache
+from util.render_template import player_page_cache
+from util.media_index import media_indexer
+from util.chunk_cache import chunk_cache
+from util.client_pool import client_pool
+from util.media_session import get_session_manager
+from util.part_share import part_coalescer
+from util.cdn import cdn_registry
+from util.part_tuner import part_tuner
+from util.admission import admission
+from util.bandwidth import bandwidth
+from util.signing import link_signer
+from util.prewarm import prewarmer, episode_prefetcher
+
+# Per-process values that mean nothing summed; merged workers report their mean.
+AVERAGED = {'hit_ratio', 'rtt_ms', 'rate', 'limit', 'window'}
+
+
+def collect_stream_stats() -> dict:
+    """Every streaming counter /health shows, for this process (JSON-safe)."""
+    return {
+        'monitor': stream_monitor.snapshot(),
+        'admission': admission.stats(),
+        'links': link_signer.stats(),
+        'meta_cache': stream_file_cache.stats(),
+        'message_cache': message_cache.stats(),
+        'page_cache': player_page_cache.stats(),
+        'probe_cache': probe_cache.stats(),
+        'chunk_cache': chunk_cache.stats(),
+        'prewarm': prewarmer.stats(),
+        'indexes': media_indexer.stats(),
+        'prefetch': episode_prefetcher.stats(),
+        'parts': part_coalescer.stats(),
+        'cdn': cdn_registry.stats(),
+        'tuning': {str(dc): t for dc, t in part_tuner.stats().items()},
+        'clients': client_pool.stats(),
+        'bandwidth': bandwidth.stats(),
+        'sessions': {m.name: get_session_manager(m.client).health() for m in client_pool.members},
+    }
+
+
+def merge_stream_stats(snapshots: list) -> dict:
+    """
+    One view of several web workers' collect_stream_stats(): counts, sizes
+    and budget shares are summed, ratios and per-DC tuning averaged, flags
+    OR-ed and lists (busiest streams, clients, top owners) concatenated.
+    """
+    return _merge(snapshots) if snapshots else {}
+
+
+def _merge(values: list, key: str | None = None):
+    present = [v for v in values if v is not None]
+    if not present:
+        return None
+    first = present[0]
+    if isinstance(first, dict):
+        keys = dict.fromkeys(k for v in present for k in v)
+        return {k: _merge([v[k] for v in present if k in v], k) for k in keys}
+    if isinstance(first, list):
+        return [item for v in present for item in v]
+    if isinstance(first, bool):
+        return any(present)
+    if isinstance(first, (int, float)):
+        if key not in AVERAGED:
+            return sum(present)
+        mean = sum(present) / len(present)
+        return round(mean) if all(isinstance(v, int) for v in present) else round(mean, 3)
+    return first
@@ -0,0 +1,146 @@
+# util/stream_stats.py
+
+import time
+import itertools
+from collections import Counter
+
+
+class StreamStats:
+    """Throughput counters for a single /stream or /download response."""
+
+    def __init__(self, stream_id: int, message_id: int, dc_id: int, start: int, end: int):
+        self.stream_id = stream_id
+        self.message_id = message_id
+        self.dc_id = dc_id
+        self.start = start
+        self.end = end
+        self.started_at = time.monotonic()
+        self.bytes_sent = 0
+        self.parts_fetched = 0
+        self.upstream_bytes = 0
+        self.upstream_wait = 0.0
+        self.cancelled_parts = 0
+        self.cancelled_bytes = 0
+
+    def record_part(self, size: int, waited: float):
+        """Called once per part handed to the client; `waited` is how long the consumer blocked on it."""
+        self.parts_fetched += 1
+        self.upstream_bytes += size
+        self.upstream_wait += waited
+
+    def record_sent(self, size: int):
+        self.bytes_sent += size
+
+    def record_cancelled(self, parts: int, size: int):
+        """Read-ahead dropped because the client left or stopped early."""
+        self.cancelled_parts += parts
+        self.cancelled_bytes += size
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started_at, 1e-6)
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second delivered to the client so far."""
+        return self.bytes_sent / self.elapsed
+
+    def as_dict(self) -> dict:
+        return {
+            'message_id': self.message_id,
+            'dc_id': self.dc_id,
+            'range': f"{self.start}-{self.end}",
+            'bytes_sent': self.bytes_sent,
+            'parts': self.parts_fetched,
+            'upstream_wait': round(self.upstream_wait, 3),
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput),
+        }
+
+
+class SlowClientGuard:
+    """
+    Decides when a connection should be dropped for draining too slowly.
+
+    Over each `grace`-second window it compares the bytes the client accepted
+    with `min_rate`. Only windows where most of the time went into blocked
+    writes count, so a slow upstream is never blamed on the viewer.
+    """
+
+    def __init__(self, min_rate: int, grace: float):
+        self.min_rate = min_rate
+        self.grace = grace
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._blocked = 0.0
+
+    def record_write(self, size: int, blocked: float) -> bool:
+        """Accounts one write; True when the client is too slow to keep."""
+        if self.min_rate <= 0 or self.grace <= 0:
+            return False
+        self._window_bytes += size
+        self._blocked += blocked
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self.grace:
+            return False
+        too_slow = self._window_bytes / elapsed < self.min_rate and self._blocked >= elapsed / 2
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._blocked = 0.0
+        return too_slow
+
+
+class StreamMonitor:
+    """Process-wide registry of active streams plus lifetime totals."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.active = {}
+        self.totals = {
+            'streams': 0,
+            'bytes_sent': 0,
+            'parts_fetched': 0,
+            'upstream_wait': 0.0,
+            'cancelled_parts': 0,
+            'cancelled_bytes': 0,
+        }
+        self.recoveries = Counter()
+        self.evictions = Counter()
+
+    def open(self, message_id: int, dc_id: int, start: int, end: int) -> StreamStats:
+        stats = StreamStats(next(self._ids), message_id, dc_id, start, end)
+        self.active[stats.stream_id] = stats
+        self.totals['streams'] += 1
+        return stats
+
+    def close(self, stats: StreamStats):
+        if self.active.pop(stats.stream_id, None) is None:
+            return
+        self.totals['bytes_sent'] += stats.bytes_sent
+        self.totals['parts_fetched'] += stats.parts_fetched
+        self.totals['upstream_wait'] += stats.upstream_wait
+        self.totals['cancelled_parts'] += stats.cancelled_parts
+        self.totals['cancelled_bytes'] += stats.cancelled_bytes
+
+    def record_recovery(self, reason: str):
+        """An upstream failure that was retried instead of ending the response."""
+        self.recoveries[reason] += 1
+
+    def record_eviction(self, reason: str):
+        """A connection closed by us because the client stopped keeping up."""
+        self.evictions[reason] += 1
+
+    def snapshot(self, limit: int = 5) -> dict:
+        """Totals plus the `limit` busiest active streams, for /health."""
+        busiest = sorted(self.active.values(), key=lambda s: s.throughput, reverse=True)[:limit]
+        return {
+            'active': len(self.active),
+            'egress_rate': round(sum(s.throughput for s in self.active.values())),
+            'totals': dict(self.totals),
+            'recoveries': dict(self.recoveries),
+            'evictions': dict(self.evictions),
+            'streams': [s.as_dict() for s in busiest],
+        }
+
+
+stream_monitor = StreamMonitor()
@@ -0,0 +1,116 @@
+# util/zipstream.py
+
+import time
+import zlib
+import struct
+
+# Every entry is written as ZIP64 (version 4.5), stored (no compression), with
+# a data descriptor after the data because the CRC is only known once the
+# bytes have been streamed. Sizes are known up front, so the total length is too.
+VERSION = 45
+FLAGS = 0x0008 | 0x0800  # data descriptor follows, UTF-8 names
+METHOD_STORE = 0
+MAX32 = 0xFFFFFFFF
+MAX16 = 0xFFFF
+
+
+def _dos_datetime(timestamp: int | None) -> tuple:
+    t = time.gmtime(timestamp or time.time())
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def unique_names(names: list) -> list:
+    """Archive member names without path separators or duplicates."""
+    counters = {}
+    used = set()
+    result = []
+    for name in names:
+        name = (name or "file").replace("/", "_").replace("\\", "_")
+        stem, dot, ext = name.rpartition(".")
+        candidate = name
+        while candidate in used:
+            counters[name] = counters.get(name, 1) + 1
+            candidate = f"{stem} ({counters[name]}).{ext}" if dot else f"{name} ({counters[name]})"
+        used.add(candidate)
+        result.append(candidate)
+    return result
+
+
+class ZipEntry:
+    def __init__(self, name: str, size: int, timestamp: int | None):
+        self.name = name.encode("utf-8")
+        self.size = size
+        self.dos_time, self.dos_date = _dos_datetime(timestamp)
+        self.offset = 0
+        self.crc = 0
+
+    def update(self, data):
+        """Feeds streamed bytes into the entry's CRC-32."""
+        self.crc = zlib.crc32(data, self.crc)
+
+    def local_header(self) -> bytes:
+        extra = struct.pack("<HHQQ", 0x0001, 16, self.size, self.size)
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, VERSION, FLAGS, METHOD_STORE, self.dos_time, self.dos_date,
+            0, MAX32, MAX32, len(self.name), len(extra)
+        ) + self.name + extra
+
+    def data_descriptor(self) -> bytes:
+        return struct.pack("<IIQQ", 0x08074B50, self.crc, self.size, self.size)
+
+    def central_header(self) -> bytes:
+        extra = struct.pack("<HHQQQ", 0x0001, 24, self.size, self.size, self.offset)
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, VERSION, VERSION, FLAGS, METHOD_STORE,
+            self.dos_time, self.dos_date, self.crc, MAX32, MAX32, len(self.name), len(extra),
+            0, 0, 0, 0, MAX32
+        ) + self.name + extra
+
+    @property
+    def local_length(self) -> int:
+        return 30 + len(self.name) + 20 + self.size + 24
+
+    @property
+    def central_length(self) -> int:
+        return 46 + len(self.name) + 28
+
+
+class ZipStream:
+    """
+    Framing for a streamed store-mode ZIP64 archive. Offsets and the exact
+    Content-Length are computed from the entry sizes before any data is sent;
+    only the CRCs are filled in as the bytes go through.
+    """
+
+    def __init__(self, entries: list):
+        self.entries = entries
+        offset = 0
+        for entry in entries:
+            entry.offset = offset
+            offset += entry.local_length
+        self.central_offset = offset
+
+    @property
+    def central_size(self) -> int:
+        return sum(entry.central_length for entry in self.entries)
+
+    @property
+    def content_length(self) -> int:
+        return self.central_offset + self.central_size + 56 + 20 + 22
+
+    def trailer(self) -> bytes:
+        """Central directory, ZIP64 end record and locator, and the classic end record."""
+        central = b"".join(entry.central_header() for entry in self.entries)
+        count = len(self.entries)
+        zip64_end_offset = self.central_offset + len(central)
+        zip64_end = struct.pack(
+            "<IQHHIIQQQQ", 0x06064B50, 44, VERSION, VERSION, 0, 0,
+            count, count, len(central), self.central_offset
+        )
+        locator = struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+        end = struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, MAX16, MAX16, MAX32, MAX32, 0)
+        return central + zip64_end + locator + end
@@ -95,6 +95,24 @@ def format_bytes(size):
     elif n == 2: return f"{round(size)} {power_labels[n]}"
     else: return f"{int(size)} {power_labels[n]}"
 
+def split_message(text: str, limit: int = TEXT_MESSAGE_LIMIT) -> list:
+    """Splits text into messages Telegram accepts, on line boundaries where possible."""
+    messages, current = [], ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            messages.append(current)
+            current = ""
+        current += line
+    if current.strip():
+        messages.append(current)
+    return messages
+
 async def get_definitive_title_from_imdb(title_from_filename):
     if not title_from_filename:
         return None, None
@@ -551,9 +569,19 @@ async def clean_and_parse_filename(name: str, cache: dict = None):
         # --- DECREED MODIFICATION: END ---
     }
 
+def parse_episode_numbers(info: dict | None):
+    """(season, first_episode, last_episode) from clean_and_parse_filename's "S01" / "E03" / "E01-E05" tags."""
+    if not info:
+        return None, None, None
+    season = re.search(r'\d+', info.get("season_info") or "")
+    episodes = [int(n) for n in re.findall(r'\d+', info.get("episode_info") or "")]
+    if not episodes:
+        return (int(season.group()) if season else None), None, None
+    return (int(season.group()) if season else None), min(episodes), max(episodes)
+
 # ---------------- CREATE POST (FINAL FIXED VERSION) ----------------
 
-async def create_post(client, user_id, messages, cache: dict):
+async def create_post(client, user_id, messages, cache: dict, batch_id: str = None):
     user = await get_user(user_id)
     if not user:
         return []
@@ -647,6 +675,9 @@ async def create_post(client, user_id, messages, cache: dict):
         f"⭐ **Rating:** {rating or 'N/A'}\n"
         f"📖 **Story:** {story or 'N/A'}\n\n"
     )
+    if batch_id and len(media_info_list) > 1:
+        zip_link = f"https://t.me/{client.me.username}?start=zip_{batch_id}"
+        base_caption += f"📦 [Download All as ZIP]({zip_link}) ({format_bytes(sum(i['file_size'] for i in media_info_list))})\n\n"
 
     # ---------- SPLIT HANDLING ----------
     final_posts = []